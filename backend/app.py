@@ -1,22 +1,32 @@
 # app.py
 import os
-import io
+import re
+import json
 import uuid
+import logging
 import fitz
+import time
 import secrets
 import hashlib
+import threading
 import datetime as dt
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, g, stream_with_context
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt
-from pymongo import MongoClient, ASCENDING, errors
+from flask_jwt_extended import JWTManager, create_access_token, get_jwt, verify_jwt_in_request
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument, errors
+from bson.binary import Binary
 import bcrypt
+import orjson
+from cachetools import TTLCache
 from fpdf import FPDF
 from tempfile import NamedTemporaryFile
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
 from openpyxl.utils import get_column_letter
 from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
 import docx2txt
 from extract_fields_from_pdf import extract_fields_from_pdf
 from dotenv import load_dotenv
@@ -32,6 +42,46 @@ GCP_CREDS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", None)
 if GCP_CREDS:
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GCP_CREDS
 
+# the extractor's E&M process pool re-imports this file as __mp_main__ in every worker;
+# those workers only parse page text, so they skip the Mongo and Vision connections below
+_IN_POOL_WORKER = __name__ == "__mp_main__"
+
+# configure only this app's logger; root handlers belong to whoever hosts the app
+logger = logging.getLogger("ocr")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_log_handler)
+    # the handler above already writes the record; don't print it again through root
+    logger.propagate = False
+logger.setLevel(logging.INFO)
+
+# ---------------------------
+# Google Vision (one client per process, gRPC channel kept alive)
+# ---------------------------
+VISION_ENDPOINT = "vision.googleapis.com:443"
+VISION_TIMEOUT = 30
+VISION_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    # full-page scans can exceed gRPC's 4 MB default message size
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+]
+
+
+def build_vision_client():
+    channel = ImageAnnotatorGrpcTransport.create_channel(VISION_ENDPOINT, options=VISION_CHANNEL_OPTIONS)
+    return vision.ImageAnnotatorClient(transport=ImageAnnotatorGrpcTransport(channel=channel))
+
+
+vision_client = None
+if not _IN_POOL_WORKER:
+    try:
+        vision_client = build_vision_client()
+    except Exception as e:
+        logger.warning("Vision client unavailable: %s", e)
+
 # ---------------------------
 # Flask + JWT + CORS
 # ---------------------------
@@ -40,20 +90,57 @@ CORS(app)
 app.config["JWT_SECRET_KEY"] = JWT_SECRET
 jwt = JWTManager(app)
 
+
+def ojson(obj, status=200):
+    # orjson-backed replacement for jsonify on large responses
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
 # ---------------------------
 # MongoDB
 # ---------------------------
-client = MongoClient(MONGODB_URI)
+client = MongoClient(
+    MONGODB_URI,
+    maxPoolSize=50,
+    minPoolSize=5,
+    retryWrites=True,
+    serverSelectionTimeoutMS=3000,
+    socketTimeoutMS=10000,
+    waitQueueTimeoutMS=2000,
+    appname="pdf-ocr",
+    # no monitor threads in pool workers; they never touch the database
+    connect=not _IN_POOL_WORKER,
+)
+if not _IN_POOL_WORKER:
+    try:
+        # warm the pool so the first login doesn't pay the TLS + auth handshake
+        client.admin.command("ping")
+    except Exception:
+        pass
 db = client[DB_NAME]
 users_coll = db["users"]
 invites_coll = db["invites"]
+metadata_coll = db["metadata"]
 
-try:
-    users_coll.create_index([("username", ASCENDING)], unique=True)
-    invites_coll.create_index([("token_hash", ASCENDING)], unique=True)
-    invites_coll.create_index("expires_at", expireAfterSeconds=0)
-except Exception:
-    pass
+
+def ensure_indexes():
+    # background builds so a missing index never blocks worker boot on a collection scan
+    try:
+        users_coll.create_index([("username", ASCENDING)], unique=True, background=True)
+        invites_coll.create_index([("token_hash", ASCENDING)], unique=True, background=True)
+        invites_coll.create_index("expires_at", expireAfterSeconds=0, background=True)
+        metadata_coll.create_index([("owner", ASCENDING), ("created_at", DESCENDING)], background=True)
+        # covers the token_hash + username + used_at lookups in peek_invite/consume_invite
+        invites_coll.create_index(
+            [("token_hash", ASCENDING), ("username", ASCENDING), ("used_at", ASCENDING)],
+            background=True,
+        )
+    except Exception:
+        pass
+
+
+if not _IN_POOL_WORKER:
+    ensure_indexes()
 
 # ---------------------------
 # RBAC helpers
@@ -61,17 +148,87 @@ except Exception:
 ROLES = {"Admin", "User", "Viewer"}
 
 
+# bcrypt releases the GIL while hashing, so a small pool lets concurrent
+# logins use every core instead of serializing on the request thread
+_bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="bcrypt")
+
+
 def hash_password(plain: str) -> bytes:
     # returns bcrypt hash bytes
     return bcrypt.hashpw(plain.encode("utf-8"), bcrypt.gensalt())
 
 
+# short-lived cache of successful bcrypt checks so repeated logins skip the KDF;
+# failures are never cached, so every wrong guess still pays the full bcrypt cost
+_verify_cache = TTLCache(maxsize=10_000, ttl=30)
+_verify_lock = threading.Lock()
+
+
 def check_password(plain: str, stored) -> bool:
     # stored may be bytes or str
     if stored is None:
         return False
     stored_bytes = stored.encode("utf-8") if isinstance(stored, str) else stored
-    return bcrypt.checkpw(plain.encode("utf-8"), stored_bytes)
+    plain_bytes = plain.encode("utf-8")
+    key = hashlib.sha256(plain_bytes + stored_bytes).hexdigest()
+    with _verify_lock:
+        cached = _verify_cache.get(key)
+    if cached:
+        return True
+    ok = bcrypt.checkpw(plain_bytes, stored_bytes)
+    if ok:
+        with _verify_lock:
+            _verify_cache[key] = True
+    return ok
+
+
+# decoded JWT claims keyed by a digest of the raw Authorization header, so a token
+# that was already verified skips HMAC verification and claim parsing
+CLAIMS_CACHE_TTL = 30
+_claims_cache = TTLCache(maxsize=10_000, ttl=CLAIMS_CACHE_TTL)
+_claims_lock = threading.Lock()
+
+
+def _auth_header_key():
+    auth = request.headers.get("Authorization", "")
+    if not auth:
+        return None
+    return hashlib.sha256(auth.encode("utf-8")).digest()[:16]
+
+
+def current_claims():
+    # claims for this request, whether they came from the cache or a fresh decode
+    claims = g.get("jwt_claims")
+    if claims is None:
+        claims = get_jwt() or {}
+    return claims
+
+
+def cached_jwt_required(fn):
+    from functools import wraps
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = _auth_header_key()
+        now = time.time()
+        entry = None
+        if key:
+            with _claims_lock:
+                entry = _claims_cache.get(key)
+        if entry and entry[1] > now:
+            claims = entry[0]
+        else:
+            verify_jwt_in_request()
+            claims = get_jwt() or {}
+            exp = claims.get("exp")
+            if key and exp:
+                # never serve a token from cache past its own expiry
+                with _claims_lock:
+                    _claims_cache[key] = (claims, min(now + CLAIMS_CACHE_TTL, exp))
+        g.jwt_claims = claims
+        return fn(*args, **kwargs)
+
+    return wrapper
 
 
 def role_required(allowed_roles):
@@ -79,9 +236,9 @@ def role_required(allowed_roles):
         from functools import wraps
 
         @wraps(fn)
-        @jwt_required()
+        @cached_jwt_required
         def wrapper(*args, **kwargs):
-            claims = get_jwt() or {}
+            claims = current_claims()
             if claims.get("role") not in allowed_roles:
                 return jsonify({"error": "Access forbidden: Insufficient role"}), 403
             return fn(*args, **kwargs)
@@ -98,68 +255,103 @@ INVITE_TTL_HOURS = int(os.getenv("INVITE_TTL_HOURS", "48"))
 ALLOWED_INVITE_ROLES = {"Admin", "Viewer"}
 
 
-def hash_token(token: str) -> str:
+def _invite_key() -> bytes:
+    # server-side key for invite hashes, 32 bytes for blake2b. Without a dedicated
+    # INVITE_HASH_KEY, derive one from the JWT secret under its own personalization
+    # label so the signing secret itself is never used as the MAC key.
+    dedicated = os.getenv("INVITE_HASH_KEY")
+    if dedicated:
+        return hashlib.sha256(dedicated.encode("utf-8")).digest()
+    return hashlib.blake2b(JWT_SECRET.encode("utf-8"), digest_size=32, person=b"invite").digest()
+
+
+_INVITE_KEY = _invite_key()
+
+
+def hash_token(token: str) -> Binary:
+    # keyed blake2b acts as a MAC, so a stored hash is useless without the server key
+    return Binary(hashlib.blake2b(token.encode("utf-8"), key=_INVITE_KEY, digest_size=32).digest())
+
+
+def _legacy_hash_token(token: str) -> str:
+    # invites created before the keyed hash stored a plain sha256 hex digest; they are still
+    # accepted until they expire (INVITE_TTL_HOURS), after which this can be removed
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 
+def _token_hash_query(token: str) -> dict:
+    return {"$in": [hash_token(token), _legacy_hash_token(token)]}
+
+
 def create_invite(username: str, role: str) -> str:
     if role not in ALLOWED_INVITE_ROLES:
         raise ValueError("Invalid role for invite")
-    username = username.strip()
-    for _ in range(5):
-        token = secrets.token_urlsafe(32)
-        token_hash = hash_token(token)
-        now = dt.datetime.utcnow()
-        expires_at = now + dt.timedelta(hours=INVITE_TTL_HOURS)
-        try:
-            invites_coll.insert_one({
-                "username": username,
-                "role": role,
-                "token_hash": token_hash,
-                "created_at": now,
-                "expires_at": expires_at,
-                "used_at": None
-            })
-            return token
-        except errors.DuplicateKeyError:
-            continue
-    raise RuntimeError("Failed to generate unique invite token")
+    # 256 bits of randomness: a token_hash collision is not a case worth retrying
+    token = secrets.token_urlsafe(32)
+    now = dt.datetime.now(dt.timezone.utc)
+    invites_coll.insert_one({
+        "username": username.strip(),
+        "role": role,
+        "token_hash": hash_token(token),
+        "created_at": now,
+        "expires_at": now + dt.timedelta(hours=INVITE_TTL_HOURS),
+        "used_at": None
+    })
+    return token
 
 
 def consume_invite(username: str, raw_token: str):
     if not raw_token:
         return None
-    token_hash = hash_token(raw_token)
-    username = (username or "").strip()
-    invite = invites_coll.find_one({"token_hash": token_hash, "username": username})
-    if not invite or invite.get("used_at"):
-        return None
-    if invite.get("expires_at") and invite["expires_at"] < dt.datetime.utcnow():
-        return None
-    invites_coll.update_one({"_id": invite["_id"]}, {"$set": {"used_at": dt.datetime.utcnow()}})
-    return invite.get("role")
+    now = dt.datetime.now(dt.timezone.utc)
+    token_hash = _token_hash_query(raw_token)
+    # match and mark used in one atomic round trip
+    invite = invites_coll.find_one_and_update(
+        {
+            "token_hash": token_hash,
+            "username": (username or "").strip(),
+            "used_at": None,
+            "expires_at": {"$gt": now},
+        },
+        {"$set": {"used_at": now}},
+        projection={"role": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    return invite.get("role") if invite else None
 
 
 def peek_invite(username: str, raw_token: str):
     if not raw_token:
         return None
-    token_hash = hash_token(raw_token)
-    username = (username or "").strip()
-    invite = invites_coll.find_one({
-        "token_hash": token_hash,
-        "username": username,
-        "used_at": None
-    })
-    if not invite:
-        return None
-    if invite.get("expires_at") and invite["expires_at"] < dt.datetime.utcnow():
-        return None
-    return invite.get("role")
+    token_hash = _token_hash_query(raw_token)
+    invite = invites_coll.find_one(
+        {
+            "token_hash": token_hash,
+            "username": (username or "").strip(),
+            "used_at": None,
+            "expires_at": {"$gt": dt.datetime.now(dt.timezone.utc)},
+        },
+        {"role": 1},
+    )
+    return invite.get("role") if invite else None
 
 
 # ---------------------------
 # Auth endpoints
 # ---------------------------
+# latched once any user exists; the collection never shrinks back to empty
+_has_admin = None
+
+
+def users_exist() -> bool:
+    global _has_admin
+    if _has_admin:
+        return True
+    if users_coll.estimated_document_count() > 0:
+        _has_admin = True
+    return bool(_has_admin)
+
+
 @app.post("/auth/signup")
 def auth_signup():
     data = request.get_json(silent=True) or {}
@@ -170,7 +362,7 @@ def auth_signup():
         return jsonify({"error": "Username and password required"}), 400
     try:
         # First user becomes Admin by default
-        if users_coll.count_documents({}) == 0:
+        if not users_exist():
             role = "Admin"
         else:
             role = "User"
@@ -182,7 +374,7 @@ def auth_signup():
             else:
                 return jsonify({"error": "Invalid or expired invite code"}), 400
 
-        hashed = hash_password(password)
+        hashed = _bcrypt_pool.submit(hash_password, password).result()
         users_coll.insert_one({"username": username, "password": hashed, "role": role})
         return jsonify({"message": "User created", "username": username, "role": role}), 201
     except errors.DuplicateKeyError:
@@ -197,8 +389,8 @@ def auth_login():
     username, password = (data.get("username") or "").strip(), data.get("password") or ""
     if not username or not password:
         return jsonify({"error": "Username and password required"}), 400
-    user = users_coll.find_one({"username": username})
-    if not user or not check_password(password, user.get("password")):
+    user = users_coll.find_one({"username": username}, {"password": 1, "role": 1})
+    if not user or not _bcrypt_pool.submit(check_password, password, user.get("password")).result():
         return jsonify({"error": "Invalid credentials"}), 401
     role = user.get("role", "User")
     token = create_access_token(identity=username, additional_claims={"role": role, "sub": username})
@@ -206,9 +398,9 @@ def auth_login():
 
 
 @app.get("/auth/me")
-@jwt_required()
+@cached_jwt_required
 def auth_me():
-    claims = get_jwt()
+    claims = current_claims()
     return jsonify({"username": claims.get("sub"), "role": claims.get("role")})
 
 
@@ -222,7 +414,7 @@ def admin_invite():
         return jsonify({"error": "Username is required"}), 400
     if role not in ALLOWED_INVITE_ROLES:
         return jsonify({"error": f"Role must be one of {sorted(list(ALLOWED_INVITE_ROLES))}"}), 400
-    if users_coll.find_one({"username": username}):
+    if users_coll.find_one({"username": username}, {"_id": 1}):
         return jsonify({"error": "User already exists"}), 409
     try:
         token = create_invite(username, role)
@@ -263,6 +455,41 @@ def legacy_login():
 # ---------------------------
 # OCR endpoint
 # ---------------------------
+_CODE_KEYS = ("Code", "code")
+_DESC_KEYS = ("Description", "description")
+_FEE_KEYS = ("Fee", "fee")
+_TYPE_KEYS = ("Type", "type")
+_DIAG_KEYS = ("Diagnosis", "diagnosis", "Description", "description")
+
+
+def _pick(d, keys, default=""):
+    # first truthy value among keys, same as chaining d.get(k) or ...
+    return next((d[k] for k in keys if d.get(k)), default)
+
+
+def _procedure_row(r):
+    # (code, description, fee) or None for rows of an unknown shape
+    if isinstance(r, (list, tuple)):
+        n = len(r)
+        return (r[0] if n > 0 else "", r[1] if n > 1 else "", r[2] if n > 2 else "")
+    if isinstance(r, dict):
+        return (_pick(r, _CODE_KEYS), _pick(r, _DESC_KEYS), _pick(r, _FEE_KEYS))
+    return None
+
+
+def _diagnosis_row(r):
+    # (type, code, diagnosis) or None for rows of an unknown shape
+    if isinstance(r, (list, tuple)):
+        n = len(r)
+        return (r[0] if n > 0 else "ICD-10", r[1] if n > 1 else "", r[2] if n > 2 else "")
+    if isinstance(r, dict):
+        return (_pick(r, _TYPE_KEYS, "ICD-10"), _pick(r, _CODE_KEYS), _pick(r, _DIAG_KEYS))
+    return None
+
+
+OCR_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png", ".doc", ".docx"}
+
+
 @app.route("/api/ocr", methods=["POST"])
 @role_required(["Admin", "User"])
 def ocr_file():
@@ -272,17 +499,23 @@ def ocr_file():
 
     filename = file.filename or "uploaded.pdf"
     ext = os.path.splitext(filename.lower())[1]
-    file_bytes = file.read()
-    file_stream = io.BytesIO(file_bytes)
+    if ext not in OCR_EXTENSIONS:
+        return jsonify({"error": f"Unsupported file type: {ext}"}), 400
+
+    # write the upload to disk once; every branch reads from that path
+    with NamedTemporaryFile(delete=False, suffix=ext) as tmp:
+        path = tmp.name
 
     try:
+        file.save(path)
         if ext == ".pdf":
-            try:
-                file_stream.seek(0)
-            except Exception:
-                pass
-
-            extracted = extract_fields_from_pdf(file_stream) or {}
+            with open(path, "rb") as fh:
+                extracted = extract_fields_from_pdf(
+                    fh,
+                    vision_enabled=vision_client is not None,
+                    vision_client=vision_client,
+                    vision_timeout=VISION_TIMEOUT,
+                ) or {}
 
             # canonical keys from extractor
             patients = extracted.get("patients", []) or []
@@ -290,35 +523,17 @@ def ocr_file():
             diagnosis_tables = extracted.get("diagnosis_tables", {}) or {}
 
             # produce legacy-friendly flattened arrays
-            medical_billing_codes = []
-            for section, rows in procedure_tables.items():
-                for r in rows:
-                    if isinstance(r, (list, tuple)):
-                        code = r[0] if len(r) > 0 else ""
-                        desc = r[1] if len(r) > 1 else ""
-                        fee = r[2] if len(r) > 2 else ""
-                    elif isinstance(r, dict):
-                        code = r.get("Code") or r.get("code") or ""
-                        desc = r.get("Description") or r.get("description") or ""
-                        fee = r.get("Fee") or r.get("fee") or ""
-                    else:
-                        continue
-                    medical_billing_codes.append({"Section": section, "Code": code, "Description": desc, "Fee": fee})
-
-            diagnosis_codes = []
-            for section, rows in diagnosis_tables.items():
-                for r in rows:
-                    if isinstance(r, (list, tuple)):
-                        typ = r[0] if len(r) > 0 else "ICD-10"
-                        code = r[1] if len(r) > 1 else ""
-                        desc = r[2] if len(r) > 2 else ""
-                    elif isinstance(r, dict):
-                        typ = r.get("Type") or r.get("type") or "ICD-10"
-                        code = r.get("Code") or r.get("code") or ""
-                        desc = r.get("Diagnosis") or r.get("diagnosis") or r.get("Description") or r.get("description") or ""
-                    else:
-                        continue
-                    diagnosis_codes.append({"Section": section, "Type": typ, "Code": code, "Diagnosis": desc})
+            medical_billing_codes = [
+                {"Section": section, "Code": code, "Description": desc, "Fee": fee}
+                for section, rows in procedure_tables.items()
+                for code, desc, fee in filter(None, map(_procedure_row, rows))
+            ]
+
+            diagnosis_codes = [
+                {"Section": section, "Type": typ, "Code": code, "Diagnosis": desc}
+                for section, rows in diagnosis_tables.items()
+                for typ, code, desc in filter(None, map(_diagnosis_row, rows))
+            ]
 
             # Ensure the legacy per-patient table fields exist (extractor already attempts this)
             # but double-check: if extractor didn't assign, try to map top-level rows into patients evenly/fallback
@@ -333,32 +548,63 @@ def ocr_file():
                 "diagnosis_codes": diagnosis_codes,
                 "metadata": extracted.get("metadata", {})
             }
-            return jsonify(response)
+            return ojson(response)
 
         elif ext in [".jpg", ".jpeg", ".png"]:
-            image = vision.Image(content=file_bytes)
-            response = vision_client.document_text_detection(image=image) if vision_client else None
+            with open(path, "rb") as fh:
+                image = vision.Image(content=fh.read())
+            response = vision_client.document_text_detection(image=image, timeout=VISION_TIMEOUT) if vision_client else None
             text = (response.full_text_annotation.text if response and getattr(response, "full_text_annotation", None) else "") or ""
             flattened = {"File Name": filename, "Extracted Text": text.strip()}
             return jsonify({"file_name": filename, "patients": [flattened], "procedure_tables": {}, "diagnosis_tables": {}, "medical_billing_codes": [], "diagnosis_codes": []})
 
-        elif ext in [".doc", ".docx"]:
-            with NamedTemporaryFile(delete=False, suffix=ext) as tmp:
-                tmp.write(file_bytes)
-                tmp.flush()
-                text = docx2txt.process(tmp.name)
+        else:
+            text = docx2txt.process(path)
             flattened = {"File Name": filename, "Extracted Text": text.strip()}
             return jsonify({"file_name": filename, "patients": [flattened], "procedure_tables": {}, "diagnosis_tables": {}, "medical_billing_codes": [], "diagnosis_codes": []})
 
-        else:
-            return jsonify({"error": f"Unsupported file type: {ext}"}), 400
-
     except Exception as e:
-        print("[ERROR] OCR failed:", e)
+        if logger.isEnabledFor(logging.ERROR):
+            logger.exception("OCR failed")
         return jsonify({"error": "OCR processing failed", "details": str(e)}), 500
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
 
 # Debug endpoint to inspect raw PyMuPDF text (handy to tune regexes)
+DEBUG_TEXT_WORKERS = 8
+
+
+def _debug_page_text(local, page_index):
+    try:
+        return local.doc[page_index].get_text("text") or ""
+    except Exception:
+        return ""
+
+
+def _iter_debug_page_texts(file_bytes, page_count):
+    # each worker thread opens its own Document; MuPDF documents are not shared across threads
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def open_worker_doc():
+        local.doc = fitz.open(stream=file_bytes, filetype="pdf")
+        with lock:
+            opened.append(local.doc)
+
+    workers = max(1, min(DEBUG_TEXT_WORKERS, page_count))
+    try:
+        with ThreadPoolExecutor(max_workers=workers, initializer=open_worker_doc) as ex:
+            yield from ex.map(lambda i: _debug_page_text(local, i), range(page_count))
+    finally:
+        for d in opened:
+            d.close()
+
+
 @app.route("/api/ocr-debug-text", methods=["POST"])
 @role_required(["Admin", "User"])
 def ocr_debug_text():
@@ -367,105 +613,114 @@ def ocr_debug_text():
         return jsonify({"error": "No file uploaded"}), 400
     file_bytes = file.read()
     try:
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
-        texts = []
-        for i, page in enumerate(doc):
-            txt = ""
-            try:
-                txt = page.get_text("text") or ""
-            except Exception:
-                txt = ""
-            texts.append(f"--- PAGE {i+1} ---\n{txt}")
-        return jsonify({"raw_text": "\n\n".join(texts)})
+        with fitz.open(stream=file_bytes, filetype="pdf") as d:
+            page_count = d.page_count
     except Exception as e:
         return jsonify({"error": "Failed to read PDF", "details": str(e)}), 500
 
+    texts = _iter_debug_page_texts(file_bytes, page_count)
+    if request.args.get("stream") == "1":
+        # opt-in: one NDJSON line per page, in page order, sent as soon as that page is extracted
+        def generate():
+            for i, txt in enumerate(texts):
+                yield json.dumps({"page": i + 1, "text": txt}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    return jsonify({"raw_text": "\n\n".join(f"--- PAGE {i+1} ---\n{txt}" for i, txt in enumerate(texts))})
+
 
 # ---------------------------
 # Excel export (3 sheets)
 # ---------------------------
+_COLS = [get_column_letter(i) for i in range(1, 64)]
+HEADER_FONT = Font(bold=True, size=12)
+
+
+def _write_only_sheet(wb, title, headers):
+    # column widths must be set before the first row is written in write-only mode
+    ws = wb.create_sheet(title=title)
+    for letter in _COLS[:len(headers)]:
+        ws.column_dimensions[letter].width = 30
+    header_row = []
+    for h in headers:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = HEADER_FONT
+        header_row.append(cell)
+    ws.append(header_row)
+    return ws
+
+
 @app.route("/api/export-excel", methods=["POST", "GET"])
 @role_required(["Admin", "User"])
 def export_excel():
-    global all_metadata
+    owner = current_claims().get("sub")
     if request.method == "POST":
         content = request.json
         if not content:
             return jsonify({"error": "No metadata to export"}), 400
         meta = content.get("metadata", content)
-        if isinstance(meta, list):
-            all_metadata.extend(meta)
-        else:
-            all_metadata.append(meta)
+        now = dt.datetime.now(dt.timezone.utc)
+        metas = meta if isinstance(meta, list) else [meta]
+        if metas:
+            metadata_coll.insert_many([{"owner": owner, "payload": m, "created_at": now} for m in metas])
         return jsonify({"message": "Metadata added"})
 
     elif request.method == "GET":
-        if not all_metadata:
+        if not metadata_coll.find_one({"owner": owner}, {"_id": 1}):
             return jsonify({"error": "No metadata to export"}), 400
 
-        wb = Workbook()
+        # write-only workbook: rows stream straight to the file instead of
+        # building every cell in memory
+        wb = Workbook(write_only=True)
 
-        # Sheet 1: Patients
-        ws1 = wb.active
-        ws1.title = "Patients"
         patient_headers = ["Patient Name", "Date of Birth", "Subscriber ID", "Primary Insurance", "Date of Service", "Patient Signature", "Physician Signature"]
-        header_font = Font(bold=True, size=12)
-        for i, h in enumerate(patient_headers, 1):
-            ws1.cell(row=1, column=i, value=h).font = header_font
-            ws1.column_dimensions[get_column_letter(i)].width = 30
-
-        row_idx = 2
-        for meta in all_metadata:
-            patients = meta.get("patients") if isinstance(meta, dict) else []
-            if not patients and isinstance(meta, dict) and all(k in meta for k in ["Patient Name", "Date of Birth"]):
-                patients = [meta]
-            for p in patients:
-                for i, h in enumerate(patient_headers, 1):
-                    val = p.get(h, "NIL") if isinstance(p, dict) else "NIL"
-                    ws1.cell(row=row_idx, column=i, value=val)
-                row_idx += 1
-
-        # Sheet 2: Medical Billing Codes
-        ws2 = wb.create_sheet(title="Billing Codes")
         billing_headers = ["Section", "Code", "Description", "Fee"]
-        for i, h in enumerate(billing_headers, 1):
-            ws2.cell(row=1, column=i, value=h).font = header_font
-            ws2.column_dimensions[get_column_letter(i)].width = 30
-        row_idx = 2
-        for meta in all_metadata:
-            billing = meta.get("medical_billing_codes", []) if isinstance(meta, dict) else []
-            for code in billing:
-                ws2.cell(row=row_idx, column=1, value=code.get("Section", ""))
-                ws2.cell(row=row_idx, column=2, value=code.get("Code", ""))
-                ws2.cell(row=row_idx, column=3, value=code.get("Description", ""))
-                ws2.cell(row=row_idx, column=4, value=code.get("Fee", ""))
-                row_idx += 1
-
-        # Sheet 3: Diagnosis Codes
-        ws3 = wb.create_sheet(title="Diagnosis Codes")
         diag_headers = ["Section", "Type", "Code", "Diagnosis"]
-        for i, h in enumerate(diag_headers, 1):
-            ws3.cell(row=1, column=i, value=h).font = header_font
-            ws3.column_dimensions[get_column_letter(i)].width = 30
-        row_idx = 2
-        for meta in all_metadata:
-            diag = meta.get("diagnosis_codes", []) if isinstance(meta, dict) else []
-            for d in diag:
-                ws3.cell(row=row_idx, column=1, value=d.get("Section", ""))
-                ws3.cell(row=row_idx, column=2, value=d.get("Type", ""))
-                ws3.cell(row=row_idx, column=3, value=d.get("Code", ""))
-                ws3.cell(row=row_idx, column=4, value=d.get("Diagnosis", ""))
-                row_idx += 1
+        ws1 = _write_only_sheet(wb, "Patients", patient_headers)
+        ws2 = _write_only_sheet(wb, "Billing Codes", billing_headers)
+        ws3 = _write_only_sheet(wb, "Diagnosis Codes", diag_headers)
+
+        # one server-side cursor pass feeds all three sheets
+        cursor = (
+            metadata_coll.find({"owner": owner}, {"payload": 1})
+            .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+            .batch_size(500)
+        )
+        for doc in cursor:
+            meta = doc.get("payload")
+            if not isinstance(meta, dict):
+                continue
+
+            # Sheet 1: Patients
+            patients = meta.get("patients")
+            if not patients and all(k in meta for k in ["Patient Name", "Date of Birth"]):
+                patients = [meta]
+            for p in patients or []:
+                if isinstance(p, dict):
+                    ws1.append([p.get(h, "NIL") for h in patient_headers])
+                else:
+                    ws1.append(["NIL"] * len(patient_headers))
+
+            # Sheet 2: Medical Billing Codes
+            for code in meta.get("medical_billing_codes", []):
+                ws2.append([code.get(h, "") for h in billing_headers])
+
+            # Sheet 3: Diagnosis Codes
+            for d in meta.get("diagnosis_codes", []):
+                ws3.append([d.get(h, "") for h in diag_headers])
 
         with NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
             wb.save(tmp.name)
-            tmp.seek(0)
-            return send_file(tmp.name, as_attachment=True, download_name="ocr_output.xlsx")
+        return send_file(tmp.name, as_attachment=True, download_name="ocr_output.xlsx")
 
 
 # ---------------------------
 # PDF export, reset, serve React, run
 # ---------------------------
+_PDF_LABEL_STRIP = re.compile(r"Address:|Employer:")
+
+
 class PDFReport(FPDF):
     def header(self):
         self.set_font("Arial", "B", 14)
@@ -480,7 +735,14 @@ class PDFReport(FPDF):
         self.set_font("Arial", "", 11)
         for key, value in metadata.items():
             if key not in ["Patient Signature", "Physician Signature"]:
-                val = str(value).replace("Address:", "").replace("Employer:", "").strip()
+                key = str(key)
+                val = _PDF_LABEL_STRIP.sub("", str(value)).strip()
+                if self._fits_one_line(key, 90) and self._fits_one_line(val, 100):
+                    # same layout as the multi_cell path, without per-character wrapping
+                    self.cell(90, 10, key, 1)
+                    self.cell(100, 10, val, 1)
+                    self.ln(10)
+                    continue
                 x = self.get_x()
                 y = self.get_y()
                 self.multi_cell(90, 10, key, 1)
@@ -488,6 +750,11 @@ class PDFReport(FPDF):
                 self.multi_cell(100, 10, val, 1)
                 self.ln(0)
 
+    def _fits_one_line(self, text, width):
+        if "\n" in text or "\r" in text:
+            return False
+        return self.get_string_width(text) <= width - 2 * self.c_margin
+
 
 @app.route("/api/export-pdf", methods=["POST"])
 @role_required(["Admin", "User", "Viewer"])
@@ -506,8 +773,8 @@ def export_pdf():
 @app.route("/api/reset", methods=["POST", "GET"])
 @role_required(["Admin"])
 def reset_metadata():
-    global all_metadata
-    all_metadata = []
+    # global, like the old in-memory list: an Admin reset clears every user's export metadata
+    metadata_coll.delete_many({})
     return jsonify({"message": "Server metadata reset successfully"})
 
 
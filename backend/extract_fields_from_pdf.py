@@ -8,13 +8,25 @@ Usage:
 
 Notes:
 - Uses PyMuPDF for text extraction by default. Optionally uses Google Vision OCR if desired.
+  Vision is only called for pages without a usable text layer (scans).
 - Returns only E&M rows parsed under EVALUATION AND MANAGEMENT headers.
 """
 
+import os
 import re
+import sys
 import fitz
 import logging
-from bisect import bisect_right
+import threading
+import multiprocessing
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from operator import attrgetter
+from itertools import accumulate
 
 # optional import; script runs without Vision
 try:
@@ -23,103 +35,330 @@ try:
 except Exception:
     _HAS_VISION = False
 
+# optional import; RE2 scans in linear time, plain re is used when it is missing
+try:
+    import re2
+except ImportError:
+    re2 = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 SEPARATOR = "\n\n---PAGE---\n\n"
 CURRENT_CENTURY_CUTOFF = 25
+PAGE_WORKERS = 8
+# E&M parsing is pure-Python regex work; below this many pages, process start-up costs more than it saves
+EM_PROCESS_MIN_PAGES = 64
+# the E&M pool lives for the whole process; keep it small next to the web workers
+EM_PROCESS_WORKERS = min(4, os.cpu_count() or 1)
+# seconds to wait on the pool before parsing in-process instead
+EM_PROCESS_TIMEOUT = 60
+# pages whose text layer has fewer characters than this are treated as scans and sent to Vision
+VISION_MIN_NATIVE_CHARS = 40
+VISION_DPI = 200
+VISION_JPEG_QUALITY = 85
+# per-request deadline (seconds) for document_text_detection
+VISION_TIMEOUT = 30
+# keys of each result["patients"] dict, in output order
+PATIENT_FIELDS = tuple(map(sys.intern, ("Base Name", "Patient Name", "Date of Birth", "Date of Service", "Primary Insurance", "Subscriber ID")))
+EM_PROCEDURES_FIELD = sys.intern("EvaluationAndManagement_Procedures")
+_PATIENT_KEYS = PATIENT_FIELDS + (EM_PROCEDURES_FIELD,)
+# placeholder for fields that could not be extracted; one shared object across all patients
+_NIL = sys.intern("NIL")
+
+# -----------------------
+# Precompiled patterns (these run per line / per window / per page)
+# -----------------------
+# re's str \s (str.isspace) and \d spelled out for RE2, whose own classes are ASCII-only
+_RE2_SPACE = r"\t\n\x0b\x0c\r\x1c-\x1f \x85\xa0\x{1680}\x{2000}-\x{200a}\x{2028}\x{2029}\x{202f}\x{205f}\x{3000}"
+_RE2_DIGIT = r"\p{Nd}"
+# İ and ı; under (?i) re lets them match i/I, RE2 does not
+_RE2_FOLD_I = r"\x{130}\x{131}"
+
+def _class_covers_i(body):
+    return "i" in body or "I" in body or any(a <= c <= b for a, b in re.findall(r"(\w)-(\w)", body) for c in "iI")
+
+def _re2_pattern(pattern):
+    """
+    Rewrite \\s, \\d and (?i) i/I so RE2 matches what re matches on str (NBSP after a label,
+    Unicode digits). None when the pattern needs \\b, \\w, \\S or \\D: RE2 only has ASCII versions.
+    """
+    if isinstance(pattern, bytes):
+        # bytes classes are ASCII in both engines; the one difference (\x0b in \s) never
+        # reaches the bytes patterns, which only see pages _RE_BYTES_UNSAFE has cleared
+        return pattern
+    fold_i = pattern.startswith("(?i)")
+    out = ["(?i)"] if fold_i else []
+    i = 4 if fold_i else 0
+    cls = None  # translated body of the character class being read
+    cls_start = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            esc = pattern[i:i + 2]
+            i += 2
+            if esc in (r"\b", r"\B", r"\w", r"\W", r"\S", r"\D"):
+                return None
+            if esc == r"\s":
+                esc = _RE2_SPACE if cls is not None else f"[{_RE2_SPACE}]"
+            elif esc == r"\d":
+                esc = _RE2_DIGIT
+            (out if cls is None else cls).append(esc)
+            continue
+        i += 1
+        if cls is None:
+            if c == "[":
+                cls = []
+                cls_start = i
+            elif fold_i and c in "iI":
+                out.append(f"[iI{_RE2_FOLD_I}]")
+            else:
+                out.append(c)
+        elif c == "]":
+            raw = pattern[cls_start:i - 1]
+            if fold_i and not raw.startswith("^") and _class_covers_i(raw):
+                cls.append(_RE2_FOLD_I)
+            out.append("[" + "".join(cls) + "]")
+            cls = None
+        else:
+            cls.append(c)
+    return "".join(out)
+
+def _fast_compile(pattern):
+    """
+    Compile a whole-page scan pattern with RE2 when it is installed, else with re.
+    Flags must be inline; patterns RE2 cannot match like re (see _re2_pattern) stay on re.
+    """
+    if re2 is not None:
+        translated = _re2_pattern(pattern)
+        if translated is not None:
+            try:
+                return re2.compile(translated)
+            except Exception:
+                logger.debug("RE2 rejected %r; using re", pattern)
+    return re.compile(pattern)
+
+# dates
+_RE_TWO_DIGIT_YEAR = re.compile(r"^(\d{1,2}/\d{1,2}/)(\d{2})$")
+_RE_NON_DATE_CHARS = re.compile(r"[^\d/]")
+_RE_DATE_SHORT = re.compile(r"^\d{1,2}/\d{1,2}/\d{2}$")
+_RE_DATE_LONG = re.compile(r"^\d{1,2}/\d{1,2}/\d{4}$")
+# already-normalized dates (ASCII digits, 4-digit year) come back from _normalize_date_token unchanged
+_CANON_DATE = re.compile(r"[0-9]{1,2}/[0-9]{1,2}/[0-9]{4}")
+_RE_DATE_EXACT = re.compile(r"^\d{1,2}/\d{1,2}/\d{2,4}$")
+_RE_DATE_TOKEN = _fast_compile(r"([0-9]{1,2}/[0-9]{1,2}/(?:[0-9]{4}|\d{2}))")
+_RE_DATE_VALUE = re.compile(r"([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})")
+_RE_YEAR4_SUFFIX = re.compile(r".*/.*/\d{4}$")
+_RE_YEAR2_SUFFIX = re.compile(r".*/.*/\d{2}$")
+
+# names
+# DOB labels and date tokens in one pass; the lookbehind keeps "DOB01/02/2000" stripping
+# the date even though no word boundary remains once the label itself is consumed
+_RE_NAME_STRIP = re.compile(r"(?i)\bDOB[:\s-]*|(?:\b|(?<=\bDOB))\d{1,2}/\d{1,2}/\d{2,4}\b")
+_RE_TRAILING_PUNCT = re.compile(r"[\/\-\:\,\s]+$")
+_RE_WS = re.compile(r"\s+")
+_RE_MULTI_SPACE = re.compile(r"\s{2,}")
+_RE_NON_NAME = re.compile(r"[^\w,\s\'\-]")
+# ASCII-only equivalent of _RE_NON_NAME for str.translate
+_NAME_KEEP_TABLE = str.maketrans({
+    c: None for c in map(chr, range(128))
+    if not (c.isalnum() or c == "_" or c.isspace() or c in ",'-")
+})
+_RE_ALPHA = re.compile(r"[A-Za-z]")
+_RE_DIGIT = re.compile(r"[0-9]")
+_RE_LASTFIRST = re.compile(r"\b([A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,})")
+_RE_LASTFIRST_FULL = re.compile(r"\b([A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,}(?:[A-Z ,.'\-\(\)]*)?)\b")
+_RE_LASTFIRST_LINE = re.compile(r"^[A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,}(?:[A-Z ,.'\-\(\)]*)?$")
+
+# segmentation anchors
+_RE_PATIENT_NAME_HDR = re.compile(r"(?i)Patient(?: Full)? Name[:\s]")
+_RE_PATIENT_HDR = re.compile(r"(?i)Patient[:\s]")
+_RE_SUBSCRIBER_HDR = re.compile(r"(?i)Subscriber ID[:\s]")
+_RE_DOB_ANCHOR = re.compile(r"\bDOB[:\s]*\d{1,2}/\d{1,2}/\d{2,4}", re.I)
+_POSITION_RES = (_RE_PATIENT_NAME_HDR, _RE_PATIENT_HDR, _RE_SUBSCRIBER_HDR, _RE_LASTFIRST, _RE_DOB_ANCHOR)
+# zero-width union of the anchors above: one pass finds every offset where any of them starts
+_RE_POSITION_SWEEP = re.compile(
+    r"(?=(?i:Patient(?: Full)? Name[:\s])|(?i:Patient[:\s])|(?i:Subscriber ID[:\s])"
+    r"|\b[A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,}|(?i:\bDOB[:\s]*\d{1,2}/\d{1,2}/\d{2,4}))"
+)
+_RE_BLANK_LINES = re.compile(r"\n{2,}")
+_RE_SEGMENT_HEAD = re.compile(r"(?i)patient(?: full)? name|subscriber id|dob")
+
+# labeled header fields
+_RE_PATIENT_NAME_VALUE = re.compile(r"(?i)Patient(?:\s+Full|\s+Name)?[:\s]*([A-Za-z0-9 ,.'\-]+|NIL)\b")
+_RE_PATIENT_LINE = re.compile(r"(?i)^\s*Patient(?:\s+Full|\s+Name)?\s*[:\-\s]\s*(.*)$")
+_RE_DOB_VALUE = re.compile(r"\bDOB[:\s]*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})", re.I)
+_RE_DOB_LABEL = _fast_compile(r"(?i)\bDOB[:\s]*([0-9]{1,2}/[0-9]{1,2}/(?:[0-9]{4}|\d{2}))")
+_RE_DOS_VALUE = re.compile(r"(?:Date\s+of\s+Service|Order\s+Date|Visit\s+Date|DOS)[:\s]*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})", re.I)
+_RE_DOS_LABEL = _fast_compile(r"(?i)(?:Date\s+of\s+Service|Visit\s+Date|Order\s+Date|DOS)[:\s]*([0-9]{1,2}/[0-9]{1,2}/(?:[0-9]{4}|\d{2}))")
+_RE_PAGE_DOS = _fast_compile(r"(?i)(?:Date\s+of\s+Service|Visit\s+Date|Order\s+Date|DOS)[:\s]*([0-9]{1,2}/[0-9]{1,2}/(?:\d{4}|\d{2}))")
+_RE_SUB_LABEL = _fast_compile(r"(?i)Subscriber(?: ID)?[:\s]*([A-Za-z0-9\-]{5,20})")
+_RE_SUB_TOKEN5 = re.compile(r"\b([A-Z0-9\-]{5,20})\b", re.I)
+_RE_SUB_TOKEN6 = _fast_compile(r"(?i)\b([A-Z0-9\-]{6,20})\b")
+_RE_SHORT_NUMBER = re.compile(r"\d{1,6}")
+_RE_ALPHA_WORD = re.compile(r"[A-Za-z\-]{3,}")
+_RE_INS_VALUE = re.compile(r"(?:Primary\s+Insurance|Primary\s+Payor|Payor|Insurance)[:\s]*([^\n\r]+)", re.I)
+_RE_INS_LABEL = _fast_compile(r"(?i)(?:Primary\s+Insurance|Primary\s+Payor|Payor|Insurance)[:\s]*([^\n\r]{3,80})")
+
+# procedure rows
+_RE_DIGITS3 = re.compile(r"\d{3,}")
+_RE_DIGITS2 = re.compile(r"\d{2}")
+_RE_CODE = re.compile(r"\b[0-9]{2,6}\b")
+_RE_FEE = re.compile(r"(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d{3,}|\d+\.\d{2})")
+_RE_COLUMN_SPLIT = re.compile(r"\s{2,}|\t|\s*\|\s*")
+_RE_CODE_DESC_FEE = re.compile(r"([0-9]{2,6})\s+(.+?)\s+(\d+\.\d{2})\s*$")
+_EM_HEADER_PATTERN = r"(?i)(Evaluation\s+and\s+Management|EVALUATION\s+AND\s+MANAGEMENT).{0,60}(New\s+Patient|\bNEW\s+PATIENT\b|\(.*NEW\s+PATIENT.*\))?"
+_EM_STOP_PATTERN = r"(?i)^(?:Code\s+Description\s+Fee|Procedures|Consultation|Counseling|Cash\s+Payment|ANNUAL\s+WELLNESS|DIAGNOSIS|Patient\s+Diagnosis|Patient\s+Procedures|COUNSELING/SCREENING/PREVENTION)"
+_RE_EM_HEADER = _fast_compile(_EM_HEADER_PATTERN)
+_RE_EM_STOP = _fast_compile(_EM_STOP_PATTERN)
+# bytes twins for ASCII pages; on ASCII input without the characters below they match the
+# same lines, which str.splitlines()/\s would otherwise treat differently from bytes
+_RE_EM_HEADER_B = _fast_compile(_EM_HEADER_PATTERN.encode("ascii"))
+_RE_EM_STOP_B = _fast_compile(_EM_STOP_PATTERN.encode("ascii"))
+_RE_BYTES_UNSAFE = re.compile(r"[\x0b\x0c\x1c-\x1f]")
+
+
+@lru_cache(maxsize=1024)
+def _base_re(base):
+    # case-insensitive literal matcher for a patient's base name, compiled once per base
+    return re.compile(re.escape(base), re.I)
+
+@lru_cache(maxsize=64)
+def _base_sweep(bases):
+    # zero-width union of a document's base names (a tuple, so re-runs of the same roster reuse it)
+    return re.compile("(?=" + "|".join(map(re.escape, bases)) + ")", re.I)
 
 # -----------------------
 # Small helpers (dates/names)
 # -----------------------
-def _first_match(pattern, text, flags=0):
-    m = re.search(pattern, text, flags)
+def _first_match(regex, text: str) -> str | None:
+    m = regex.search(text)
     return m.group(1).strip() if m else None
 
-def _expand_two_digit_year(s):
-    m = re.match(r"^(\d{1,2}/\d{1,2}/)(\d{2})$", s)
+def _expand_two_digit_year(s: str) -> str:
+    m = _RE_TWO_DIGIT_YEAR.match(s)
     if not m:
         return s
     yy = int(m.group(2))
     yyyy = 2000 + yy if yy <= CURRENT_CENTURY_CUTOFF else 1900 + yy
     return m.group(1) + str(yyyy)
 
-def _normalize_date_token(tok):
+@lru_cache(maxsize=4096)
+def _normalize_date_token(tok: str | None) -> str | None:
     if not tok:
         return None
+    if _CANON_DATE.fullmatch(tok):
+        return tok
     tok = tok.strip()
-    tok = re.sub(r"[^\d/]", "", tok)
-    if re.match(r"^\d{1,2}/\d{1,2}/\d{2}$", tok):
+    tok = _RE_NON_DATE_CHARS.sub("", tok)
+    if _RE_DATE_SHORT.match(tok):
         return _expand_two_digit_year(tok)
-    if re.match(r"^\d{1,2}/\d{1,2}/\d{4}$", tok):
+    if _RE_DATE_LONG.match(tok):
         return tok
     return tok
 
-def _strip_dob_and_date_tokens(name):
+def _strip_dob_and_date_tokens(name: str) -> str:
     if not name:
         return name
-    s = str(name).strip()
-    s = re.sub(r"(?i)\bDOB[:\s-]*", " ", s)
-    s = re.sub(r"\b\d{1,2}/\d{1,2}/\d{2,4}\b", " ", s)
-    s = re.sub(r"[\/\-\:\,\s]+$", "", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def _normalize_name(n):
+    s = _RE_NAME_STRIP.sub(" ", str(name))
+    s = _RE_TRAILING_PUNCT.sub("", s)
+    return " ".join(s.split())
+
+@lru_cache(maxsize=4096)
+def _normalize_name(n: object) -> str:
     if n is None:
         return ""
-    s = str(n).strip()
-    s = _strip_dob_and_date_tokens(s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    return _strip_dob_and_date_tokens(str(n).strip())
 
-def _base_name(name):
+@lru_cache(maxsize=4096)
+def _base_name(name: str) -> str:
     if not name:
         return ""
-    s = _normalize_name(name)
-    s = s.upper()
-    s = re.sub(r"[^\w,\s\'\-]", "", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    s = _normalize_name(name).upper()
+    if s.isascii():
+        s = s.translate(_NAME_KEEP_TABLE)
+    else:
+        s = _RE_NON_NAME.sub("", s)
+    return " ".join(s.split())
 
-def _is_noise_name(name):
+_NOISE_EXACT = frozenset({"NIL", "NAME", "PATIENT", "-", "--", "N/A", "NA"})
+_NOISE_SUBSTR_RE = re.compile("PPO|MEDICARE|INSURANCE|PLAN|AETNA|CIGNA|MEDICAID|GROUP")
+
+def _is_noise_name(name: str | None) -> bool:
     if not name:
         return True
     up = name.strip().upper()
-    if up in ("NIL", "NAME", "PATIENT", "-", "--", "N/A", "NA"):
-        return True
-    if any(x in up for x in ("PPO", "MEDICARE", "INSURANCE", "PLAN", "AETNA", "CIGNA", "MEDICAID", "GROUP")):
-        return True
-    alpha_chars = re.findall(r"[A-Za-z]", name)
-    if len(alpha_chars) < 2:
+    if up in _NOISE_EXACT or _NOISE_SUBSTR_RE.search(up):
         return True
-    tokens = [t for t in re.split(r"\s+", name.strip()) if t]
-    if len(tokens) == 1 and len(tokens[0]) <= 2:
+    # fewer than two ASCII letters; stop counting as soon as the second one shows up
+    alpha: int = 0
+    for c in name:
+        if c.isascii() and c.isalpha():
+            alpha += 1
+            if alpha == 2:
+                break
+    else:
         return True
-    return False
+    tokens = name.split()
+    return len(tokens) == 1 and len(tokens[0]) <= 2
 
 # -----------------------
 # segmentation
 # -----------------------
 def _find_positions(text):
+    # an anchor only counts where its own finditer would report it, i.e. not inside
+    # its previous match, so each anchor keeps its last end while the sweep advances
     starts = []
-    for m in re.finditer(r"(?i)Patient(?: Full)? Name[:\s]", text):
-        starts.append(m.start())
-    for m in re.finditer(r"(?i)Patient[:\s]", text):
-        starts.append(m.start())
-    for m in re.finditer(r"(?i)Subscriber ID[:\s]", text):
-        starts.append(m.start())
-    for m in re.finditer(r"\b([A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,})", text):
-        starts.append(m.start())
-    for m in re.finditer(r"\bDOB[:\s]*\d{1,2}/\d{1,2}/\d{2,4}", text, re.I):
-        starts.append(m.start())
-    starts = sorted(set(starts))
+    last_end = [0] * len(_POSITION_RES)
+    for hit in _RE_POSITION_SWEEP.finditer(text):
+        pos = hit.start()
+        found = False
+        for k, regex in enumerate(_POSITION_RES):
+            if pos < last_end[k]:
+                continue
+            m = regex.match(text, pos)
+            if m:
+                last_end[k] = m.end()
+                found = True
+        if found:
+            starts.append(pos)
     return starts
 
-def _split_segments(text):
+def _split_segments_from_blocks(page_blocks, page_texts, page_offsets):
+    # one segment per MuPDF text block; offsets follow the unstripped page join
+    segs = []
+    for page_idx, blocks in enumerate(page_blocks):
+        ptxt = page_texts[page_idx]
+        cursor = 0
+        for b in blocks:
+            if b[6] != 0:
+                continue
+            btxt = b[4].strip()
+            if not btxt:
+                continue
+            pos = ptxt.find(btxt, cursor)
+            if pos >= 0:
+                cursor = pos + len(btxt)
+            else:
+                pos = cursor
+            start = page_offsets[page_idx] + pos
+            segs.append({"text": btxt, "start": start, "end": start + len(btxt), "page": page_idx})
+    return segs
+
+def _split_segments(text, load_blocks=None):
+    """
+    Cut text into candidate patient segments at header/name/DOB anchors. Without any
+    anchor, fall back to layout blocks from load_blocks() (page_blocks, page_texts,
+    page_offsets) when given, else to blank-line paragraphs.
+    """
     starts = _find_positions(text)
     if not starts:
-        blocks = [b.strip() for b in re.split(r"\n{2,}", text) if b.strip()]
+        layout = load_blocks() if load_blocks else None
+        if layout:
+            segs = _split_segments_from_blocks(*layout)
+            if segs:
+                return segs
+        blocks = [b.strip() for b in _RE_BLANK_LINES.split(text) if b.strip()]
         segs = []
         offset = 0
         for b in blocks:
@@ -134,7 +373,7 @@ def _split_segments(text):
         seg = text[starts[i]:starts[i+1]].strip()
         if seg:
             segments.append({"text": seg, "start": starts[i], "end": starts[i+1]})
-    if segments and not re.search(r"(?i)patient(?: full)? name|subscriber id|dob", segments[0]["text"][:120]):
+    if segments and not _RE_SEGMENT_HEAD.search(segments[0]["text"][:120]):
         if len(segments) > 1:
             segments[1]["text"] = segments[0]["text"] + "\n" + segments[1]["text"]
             segments[1]["start"] = segments[0]["start"]
@@ -144,6 +383,15 @@ def _split_segments(text):
 # -----------------------
 # merging / dedupe
 # -----------------------
+_MISSING = ("", "NIL")
+
+def _fill_missing(target, source, keys):
+    for k in keys:
+        ev = target.get(k, "NIL")
+        nv = source.get(k, "NIL")
+        if (not ev or ev in _MISSING) and nv and nv not in _MISSING:
+            target[k] = nv
+
 def _merge_patients(patients, combined_text):
     for p in patients:
         p["Patient Name"] = _normalize_name(p.get("Patient Name", "") or "")
@@ -152,14 +400,17 @@ def _merge_patients(patients, combined_text):
         p["Date of Birth"] = p.get("Date of Birth") or "NIL"
         p["Primary Insurance"] = p.get("Primary Insurance") or "NIL"
 
+    # the first LAST, FIRST run in the document is the same for every noise-named record,
+    # so search for it at most once
+    fallback_name = None
     for p in patients:
         if _is_noise_name(p["Patient Name"]) and (p["Subscriber ID"] or (p["Date of Birth"] and p["Date of Birth"] != "NIL")):
-            mname = re.search(r"\b([A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,}(?:[A-Z ,.'\-\(\)]*)?)\b", combined_text)
-            if mname:
-                cand = mname.group(1).strip()
-                if not _is_noise_name(cand):
-                    p["Patient Name"] = _normalize_name(cand)
-                    p["Base Name"] = _base_name(cand)
+            if fallback_name is None:
+                mname = _RE_LASTFIRST_FULL.search(combined_text)
+                fallback_name = mname.group(1).strip() if mname else ""
+            if fallback_name and not _is_noise_name(fallback_name):
+                p["Patient Name"] = _normalize_name(fallback_name)
+                p["Base Name"] = _base_name(fallback_name)
 
     merged_by_sub = {}
     for p in patients:
@@ -168,12 +419,7 @@ def _merge_patients(patients, combined_text):
             if sub not in merged_by_sub:
                 merged_by_sub[sub] = dict(p)
             else:
-                ex = merged_by_sub[sub]
-                for k in ("Patient Name", "Date of Birth", "Primary Insurance", "Date of Service"):
-                    ev = ex.get(k, "NIL")
-                    nv = p.get(k, "NIL")
-                    if (not ev or ev in ("", "NIL")) and nv and nv not in ("", "NIL"):
-                        ex[k] = nv
+                _fill_missing(merged_by_sub[sub], p, ("Patient Name", "Date of Birth", "Primary Insurance", "Date of Service"))
 
     by_name = {}
     for p in patients:
@@ -187,46 +433,28 @@ def _merge_patients(patients, combined_text):
         if base not in by_name:
             by_name[base] = dict(p)
         else:
-            ex = by_name[base]
-            for k in ("Patient Name", "Date of Birth", "Primary Insurance", "Subscriber ID", "Date of Service"):
-                ev = ex.get(k, "NIL")
-                nv = p.get(k, "NIL")
-                if (not ev or ev in ("", "NIL")) and nv and nv not in ("", "NIL"):
-                    ex[k] = nv
-
-    final = []
-    for rec in merged_by_sub.values():
-        final.append(rec)
-    existing_subs = set([rec.get("Subscriber ID") for rec in final if rec.get("Subscriber ID")])
+            _fill_missing(by_name[base], p, ("Patient Name", "Date of Birth", "Primary Insurance", "Subscriber ID", "Date of Service"))
+
+    # merged_by_sub doubles as the subscriber index over the records already in final
+    final = list(merged_by_sub.values())
     for rec in by_name.values():
-        if rec.get("Subscriber ID") and rec.get("Subscriber ID") in existing_subs:
-            for f in final:
-                if f.get("Subscriber ID") == rec.get("Subscriber ID"):
-                    for k in ("Patient Name", "Date of Birth", "Primary Insurance", "Date of Service"):
-                        ev = f.get(k, "NIL")
-                        nv = rec.get(k, "NIL")
-                        if (not ev or ev in ("", "NIL")) and nv and nv not in ("", "NIL"):
-                            f[k] = nv
-                    break
+        target = merged_by_sub.get(rec.get("Subscriber ID")) if rec.get("Subscriber ID") else None
+        if target is not None:
+            _fill_missing(target, rec, ("Patient Name", "Date of Birth", "Primary Insurance", "Date of Service"))
             continue
         if _is_noise_name(rec.get("Patient Name")) and (not rec.get("Date of Birth") or rec.get("Date of Birth") == "NIL") and (not rec.get("Subscriber ID")):
             continue
         final.append(rec)
 
-    collapsed = []
-    seen = {}
+    by_base = defaultdict(list)
     for rec in final:
-        base = rec.get("Base Name") or _base_name(rec.get("Patient Name") or "")
-        if base in seen:
-            target = seen[base]
-            for k in ("Patient Name", "Date of Birth", "Subscriber ID", "Primary Insurance", "Date of Service"):
-                ev = target.get(k, "NIL")
-                nv = rec.get(k, "NIL")
-                if (not ev or ev in ("", "NIL")) and nv and nv not in ("", "NIL"):
-                    target[k] = nv
-        else:
-            seen[base] = dict(rec)
-            collapsed.append(seen[base])
+        by_base[rec.get("Base Name") or _base_name(rec.get("Patient Name") or "")].append(rec)
+    collapsed = []
+    for group in by_base.values():
+        target = dict(group[0])
+        for rec in group[1:]:
+            _fill_missing(target, rec, ("Patient Name", "Date of Birth", "Subscriber ID", "Primary Insurance", "Date of Service"))
+        collapsed.append(target)
 
     output = []
     for r in collapsed:
@@ -239,43 +467,39 @@ def _merge_patients(patients, combined_text):
 # -----------------------
 # procedure parsing helpers (E&M only)
 # -----------------------
-def _normalize_fee(raw):
+def _normalize_fee(raw: str | None) -> str:
+    # one pass over the token: keep the digits and the first ".", then pad or trim to cents
     if raw is None:
         return ""
-    s = str(raw).strip()
-    if not s:
+    digits: list[str] = []
+    dot: int = -1
+    for ch in str(raw):
+        if ch.isdecimal():
+            digits.append(ch)
+        elif ch == "." and dot < 0:
+            dot = len(digits)
+    if not digits:
         return ""
-    s = s.replace("\u00A0", " ")
-    s = re.sub(r"[^\d\.,]", "", s)
-    s = s.replace(",", "")
-    if not s:
-        return ""
-    if re.fullmatch(r"\d{3,}", s):
-        s = s + ".00"
-    if re.fullmatch(r"\d+", s):
-        s = s + ".00"
-    if re.fullmatch(r"\d+\.\d$", s):
-        s = s + "0"
-    m = re.search(r"(\d+\.\d{2})", raw)
-    if m:
-        return m.group(1)
-    return s
+    if dot < 0:
+        return "".join(digits) + ".00"
+    cents = "".join(digits[dot:dot + 2])
+    return "".join(digits[:dot]) + "." + cents.ljust(2, "0")
 
 def _cleanup_description(desc: str) -> str:
     if desc is None:
         return ""
-    s = re.sub(r"\s+", " ", str(desc).strip())
+    s = _RE_WS.sub(" ", str(desc).strip())
     s = s.strip(" \t\n\r.,;:-")
     if not s:
         return ""
     tokens = s.split()
-    cleaned_tokens = []
+    cleaned_tokens: list[str] = []
     for t in tokens:
-        if re.search(r"[A-Za-z]", t):
+        if _RE_ALPHA.search(t):
             cleaned_tokens.append(t)
-        elif re.fullmatch(r"\d{3,}", t):
+        elif _RE_DIGITS3.fullmatch(t):
             cleaned_tokens.append(t)
-        elif re.fullmatch(r"\d{2}", t):
+        elif _RE_DIGITS2.fullmatch(t):
             cleaned_tokens.append(t)
         else:
             continue
@@ -283,27 +507,27 @@ def _cleanup_description(desc: str) -> str:
         return s
     return " ".join(cleaned_tokens)
 
-def split_line_into_candidate_subrows(line):
+def split_line_into_candidate_subrows(line: str) -> list[list[str]]:
     if not line:
         return []
-    rows = []
-    code_matches = list(re.finditer(r"\b[0-9]{2,6}\b", line))
-    fee_matches = list(re.finditer(r"(\d{1,3}(?:,\d{3})*(?:\.\d{2})|\d{3,}|\d+\.\d{2})", line))
-    for cm in code_matches:
-        cstart, cend = cm.start(), cm.end()
-        fee_match = None
-        for fm in fee_matches:
-            if fm.start() > cend:
-                fee_match = fm
-                break
-        if fee_match:
-            fee_raw = fee_match.group(1)
-            mid = line[cend:fee_match.start()]
-            desc = _cleanup_description(mid)
-            rows.append([cm.group(0), desc, fee_raw])
+    rows: list[list[str]] = []
+    # codes and fees overlap (a 5-digit code is also a bare fee), so they are scanned
+    # separately; both come back in order, so one pointer finds each code's next fee
+    fee_matches = list(_RE_FEE.finditer(line))
+    fee_starts = [fm.start() for fm in fee_matches]
+    k = 0
+    for cm in _RE_CODE.finditer(line):
+        cend = cm.end()
+        while k < len(fee_starts) and fee_starts[k] <= cend:
+            k += 1
+        if k == len(fee_starts):
+            break
+        fee_match = fee_matches[k]
+        desc = _cleanup_description(line[cend:fee_starts[k]])
+        rows.append([cm.group(0), desc, fee_match.group(1)])
     if rows:
         return rows
-    parts = re.split(r"\s{2,}|\t|\s*\|\s*", line)
+    parts = _RE_COLUMN_SPLIT.split(line)
     parts = [p.strip() for p in parts if p and p.strip()]
     if len(parts) >= 3:
         code = parts[0]
@@ -312,22 +536,38 @@ def split_line_into_candidate_subrows(line):
         fee_val = _normalize_fee(fee)
         desc = _cleanup_description(desc)
         return [[code, desc, fee_val]]
-    m = re.search(r"([0-9]{2,6})\s+(.+?)\s+(\d+\.\d{2})\s*$", line)
+    m = _RE_CODE_DESC_FEE.search(line)
     if m:
         desc = _cleanup_description(m.group(2).strip())
         rows.append([m.group(1), desc, m.group(3)])
     return rows
 
+@dataclass(slots=True)
+class EmRow:
+    """One parsed E&M row; code is interned (CPT codes come from a small set)."""
+    code: str
+    description: str
+    fee: str
+
+# (code, description, fee) tuple for the procedure tables
+_EM_ROW_FIELDS = attrgetter("code", "description", "fee")
+
 def extract_em_sections_from_page_text(page_text):
     if not page_text:
         return []
-    lines = page_text.splitlines()
+    if page_text.isascii() and not _RE_BYTES_UNSAFE.search(page_text):
+        # scan as bytes and decode only the header and the lines inside a section
+        lines = page_text.encode("ascii").splitlines()
+        header_re, stop_re, decode = _RE_EM_HEADER_B, _RE_EM_STOP_B, bytes.decode
+    else:
+        lines = page_text.splitlines()
+        header_re, stop_re, decode = _RE_EM_HEADER, _RE_EM_STOP, str
     em_blocks = []
-    em_header_re = re.compile(r"(?i)(Evaluation\s+and\s+Management|EVALUATION\s+AND\s+MANAGEMENT).{0,60}(New\s+Patient|\bNEW\s+PATIENT\b|\(.*NEW\s+PATIENT.*\))?", re.I)
-    stop_re = re.compile(r"(?i)^(?:Code\s+Description\s+Fee|Procedures|Consultation|Counseling|Cash\s+Payment|ANNUAL\s+WELLNESS|DIAGNOSIS|Patient\s+Diagnosis|Patient\s+Procedures|COUNSELING/SCREENING/PREVENTION)", re.I)
+    # descriptions and fees repeat across rows; keep one copy of each per page
+    seen = {}
     for idx, ln in enumerate(lines):
-        if em_header_re.search(ln):
-            header = ln.strip()
+        if header_re.search(ln):
+            header = decode(ln.strip())
             j = idx + 1
             raw_lines = []
             parsed_rows = []
@@ -338,73 +578,197 @@ def extract_em_sections_from_page_text(page_text):
                     continue
                 if stop_re.search(cur):
                     break
+                cur = decode(cur)
                 raw_lines.append(cur)
                 cand_rows = split_line_into_candidate_subrows(cur)
                 for cr in cand_rows:
                     code = cr[0] if len(cr) > 0 else ""
                     desc = cr[1] if len(cr) > 1 else ""
                     fee = _normalize_fee(cr[2] if len(cr) > 2 else "")
-                    parsed_rows.append((code, desc, fee))
+                    parsed_rows.append(EmRow(sys.intern(code), seen.setdefault(desc, desc), seen.setdefault(fee, fee)))
                 j += 1
             em_blocks.append({"header": header, "raw_lines": raw_lines, "parsed_rows": parsed_rows})
     return em_blocks
 
-def assign_em_rows_to_patients(em_by_page, page_texts, patients, combined_text):
-    page_patient_bases = {}
-    for i, ptxt in enumerate(page_texts):
-        page_patient_bases[i] = []
-        for p in patients:
-            base = p.get("Base Name") or _base_name(p.get("Patient Name") or "")
-            if not base:
-                continue
-            if re.search(re.escape(base), ptxt, re.I):
-                page_patient_bases[i].append(base)
-    patient_em = {p.get("Base Name") or _base_name(p.get("Patient Name") or ""): [] for p in patients}
+_em_pool = None
+_em_pool_lock = threading.Lock()
+
+def _get_em_pool():
+    # created on first use and reused. Workers come from forkserver/spawn, never a plain fork:
+    # the caller (a Flask worker) already runs threads whose locks a forked child could inherit held.
+    # Both still import the caller's script as __mp_main__, so app.py keeps its connections behind a guard
+    global _em_pool
+    with _em_pool_lock:
+        if _em_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context("forkserver")
+                # the server preloads only the parser, not the default __main__ (which would run app.py)
+                ctx.set_forkserver_preload(["extract_fields_from_pdf"])
+            else:
+                ctx = multiprocessing.get_context("spawn")
+            _em_pool = ProcessPoolExecutor(max_workers=EM_PROCESS_WORKERS, mp_context=ctx)
+        return _em_pool
+
+def _discard_em_pool(pool):
+    global _em_pool
+    with _em_pool_lock:
+        if _em_pool is pool:
+            _em_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _extract_em_by_page(page_texts):
+    """E&M blocks keyed by page index; long documents are parsed across processes to get past the GIL."""
+    results = None
+    if len(page_texts) >= EM_PROCESS_MIN_PAGES:
+        chunksize = max(1, len(page_texts) // (EM_PROCESS_WORKERS * 4))
+        pool = None
+        try:
+            pool = _get_em_pool()
+            results = list(pool.map(extract_em_sections_from_page_text, page_texts,
+                                    chunksize=chunksize, timeout=EM_PROCESS_TIMEOUT))
+        except Exception as e:
+            logger.info("E&M process pool failed, parsing in-process: %s", e)
+            if pool is not None:
+                # broken or stuck; the next long document gets a fresh pool
+                _discard_em_pool(pool)
+    if results is None:
+        results = map(extract_em_sections_from_page_text, page_texts)
+    return {page_idx: blocks for page_idx, blocks in enumerate(results) if blocks}
+
+def _final_date(value):
+    if not value or value == _NIL:
+        return _NIL
+    if _CANON_DATE.fullmatch(value):
+        return value
+    return _normalize_date_token(value) or value
+
+def _patient_base(p):
+    return p.get("Base Name") or _base_name(p.get("Patient Name") or "")
+
+def _index_base_occurrences(page_texts, bases):
+    """
+    Map each base name to its (page_idx, start, end) hits, in page order, identical to
+    _base_re(base).finditer(page). ASCII pages use str.find on lowered text; other pages
+    get one case-insensitive sweep that finds every position where some base starts,
+    tracking each base's last end to keep its hits non-overlapping.
+    """
+    bases = list(dict.fromkeys(b for b in bases if b))
+    occurrences = {b: [] for b in bases}
+    if not bases:
+        return occurrences
+    lowered = {b: b.lower() for b in bases if b.isascii()}
+    sweep = None
+    for page_idx, ptxt in enumerate(page_texts):
+        if not ptxt:
+            continue
+        if ptxt.isascii():
+            # ASCII case folding keeps lengths, so str.find over the lowered page gives the
+            # same non-overlapping offsets as the case-insensitive regex
+            plow = ptxt.lower()
+            for b in bases:
+                hits = occurrences[b]
+                blow = lowered.get(b)
+                if blow is None:
+                    hits.extend((page_idx, m.start(), m.end()) for m in _base_re(b).finditer(ptxt))
+                    continue
+                pos = plow.find(blow)
+                while pos >= 0:
+                    hits.append((page_idx, pos, pos + len(blow)))
+                    pos = plow.find(blow, pos + len(blow))
+            continue
+        if sweep is None:
+            sweep = _base_sweep(tuple(bases))
+            matchers = [(_base_re(b).match, occurrences[b]) for b in bases]
+        last_end = [0] * len(matchers)
+        for hit in sweep.finditer(ptxt):
+            pos = hit.start()
+            for k, (match, hits) in enumerate(matchers):
+                if pos < last_end[k]:
+                    continue
+                m = match(ptxt, pos)
+                if m:
+                    hits.append((page_idx, pos, m.end()))
+                    last_end[k] = m.end()
+    return occurrences
+
+def _page_offsets(page_texts):
+    # start of each page within the (unstripped) SEPARATOR join, plus the total length
+    return list(accumulate((len(t) + len(SEPARATOR) for t in page_texts), initial=0))
+
+def _combined_lead(page_texts):
+    # characters strip() removed from the front of the SEPARATOR join
+    first = page_texts[0] if page_texts else ""
+    if first.strip():
+        return len(first) - len(first.lstrip())
+    return len(first) + len(SEPARATOR) - len(SEPARATOR.lstrip())
+
+def _combined_base_positions(page_texts, offsets, occurrences):
+    """
+    Translate per-page base hits into sorted offsets within combined_text (the stripped
+    SEPARATOR join), adding hits inside the separators themselves so the result matches
+    a finditer over combined_text.
+    """
+    lead = _combined_lead(page_texts)
+    sep_core = SEPARATOR.strip()
+    sep_starts = [offsets[j] - len(SEPARATOR) + SEPARATOR.index(sep_core) - lead for j in range(1, len(page_texts))]
+    positions = {}
+    for base, hits in occurrences.items():
+        found = [offsets[pg] + start - lead for pg, start, _ in hits]
+        core_hits = [m.start() for m in _base_re(base).finditer(sep_core)]
+        if core_hits:
+            found.extend(s0 + k for s0 in sep_starts for k in core_hits)
+            found.sort()
+        positions[base] = found
+    return positions
+
+def assign_em_rows_to_patients(em_by_page, page_texts, patients, combined_text, occurrences=None, page_offsets=None):
+    patient_bases = [_patient_base(p) for p in patients]
+    if occurrences is None:
+        occurrences = _index_base_occurrences(page_texts, patient_bases)
+    if page_offsets is None:
+        page_offsets = _page_offsets(page_texts)
+    pages_by_base = {base: {hit[0] for hit in hits} for base, hits in occurrences.items()}
+    patient_em = {base: [] for base in patient_bases}
+    base_positions = None
     for page_idx, blocks in em_by_page.items():
-        bases_here = page_patient_bases.get(page_idx, [])
-        assigned_base = None
-        if bases_here:
-            assigned_base = bases_here[0]
-        else:
-            offsets = []
-            cumul = 0
-            for ptxt in page_texts:
-                offsets.append(cumul)
-                cumul += len(ptxt) + len(SEPARATOR)
-            page_abs_start = offsets[page_idx] if page_idx < len(offsets) else 0
+        assigned_base = next((base for base in patient_bases if base and page_idx in pages_by_base.get(base, ())), None)
+        if not assigned_base:
+            if base_positions is None:
+                base_positions = _combined_base_positions(page_texts, page_offsets, occurrences)
+            page_abs_start = page_offsets[page_idx] if page_idx < len(page_texts) else 0
             best_base = None
             best_dist = None
-            for p in patients:
-                base = p.get("Base Name") or _base_name(p.get("Patient Name") or "")
-                if not base:
+            for base in dict.fromkeys(patient_bases):
+                positions = base_positions.get(base)
+                if not positions:
                     continue
-                for m in re.finditer(re.escape(base), combined_text, re.I):
-                    pos = m.start()
-                    dist = abs(pos - page_abs_start)
-                    if best_dist is None or dist < best_dist:
-                        best_dist = dist
-                        best_base = base
+                i = bisect_left(positions, page_abs_start)
+                dist = min(abs(positions[j] - page_abs_start) for j in (i - 1, i) if 0 <= j < len(positions))
+                if best_dist is None or dist < best_dist:
+                    best_dist = dist
+                    best_base = base
             assigned_base = best_base or next(iter(patient_em.keys()), None)
         if not assigned_base:
             continue
+        rows = patient_em.setdefault(assigned_base, [])
         for b in blocks:
-            for code, desc, fee in b.get("parsed_rows", []):
-                patient_em.setdefault(assigned_base, []).append({"Code": code, "Description": desc, "Fee": fee})
+            rows.extend({"Code": row.code, "Description": row.description, "Fee": row.fee} for row in b.get("parsed_rows", []))
     return patient_em
 
 # -----------------------
 # aggressive recovery helper (this was missing previously)
 # -----------------------
-def _score_subscriber_candidate(tok, window):
+def _score_subscriber_candidate(tok, window, subpos=None):
+    # subpos: window.lower().find("subscriber"), passed in by callers scoring many tokens of one window
     if not tok:
         return -1000
     t = tok.strip()
-    if re.match(r"^\d{1,2}/\d{1,2}/\d{2,4}$", t):
+    if _RE_DATE_EXACT.match(t):
         return -1000
-    if re.fullmatch(r"\d{1,6}", t):
+    if _RE_SHORT_NUMBER.fullmatch(t):
         return -500
     score = 0
-    if re.search(r"[A-Za-z]", t) and re.search(r"[0-9]", t):
+    if _RE_ALPHA.search(t) and _RE_DIGIT.search(t):
         score += 50
     if "-" in t:
         score += 5
@@ -412,28 +776,30 @@ def _score_subscriber_candidate(tok, window):
         score += 10
     if len(t) >= 10:
         score += 5
-    subpos = window.lower().find("subscriber")
+    if subpos is None:
+        subpos = window.lower().find("subscriber")
     if subpos >= 0:
         win_idx = window.find(t)
         if win_idx != -1 and abs(win_idx - subpos) <= 80:
             score += 20
-    if re.fullmatch(r"[A-Za-z\-]{3,}", t):
+    if _RE_ALPHA_WORD.fullmatch(t):
         score -= 10
     if len(t) < 6:
         score -= 5
     return score
 
 def _best_subscriber_from_window(window):
-    msub = re.search(r"Subscriber(?: ID)?[:\s]*([A-Za-z0-9\-]{5,20})", window, re.I)
+    msub = _RE_SUB_LABEL.search(window)
     if msub:
         cand = msub.group(1).strip()
-        if not re.fullmatch(r"\d{1,6}", cand):
+        if not _RE_SHORT_NUMBER.fullmatch(cand):
             return cand
-    tokens = re.findall(r"\b([A-Z0-9\-]{5,20})\b", window, re.I)
+    tokens = _RE_SUB_TOKEN5.findall(window)
     best = None
     best_score = -10**9
+    subpos = window.lower().find("subscriber")
     for t in tokens:
-        sc = _score_subscriber_candidate(t, window)
+        sc = _score_subscriber_candidate(t, window, subpos)
         if sc > best_score:
             best_score = sc
             best = t
@@ -441,58 +807,212 @@ def _best_subscriber_from_window(window):
         return best
     return None
 
-def _detect_page_level_subscribers(page_texts):
+def _page_subscriber(ptxt):
+    for m in _RE_SUB_LABEL.finditer(ptxt):
+        cand = m.group(1).strip()
+        if not _RE_SHORT_NUMBER.fullmatch(cand):
+            return cand
+    best = None
+    best_score = -10**9
+    subpos = ptxt.lower().find("subscriber")
+    for t in _RE_SUB_TOKEN6.findall(ptxt):
+        sc = _score_subscriber_candidate(t, ptxt, subpos)
+        if sc > best_score:
+            best_score = sc
+            best = t
+    return best if best_score > 0 else None
+
+def _page_dos(ptxt):
+    m = _RE_PAGE_DOS.search(ptxt)
+    return _normalize_date_token(m.group(1).strip()) if m else None
+
+def _page_level_dos_from_combined(combined_text, page_texts, offsets):
+    """
+    First DOS per page from one scan of combined_text, each hit mapped back to its page by
+    bisect. A DOS match cannot run through a separator's dashes, so hits never straddle pages.
+    """
+    lead = _combined_lead(page_texts)
+    page_level_dos = {}
+    seen = set()
+    for m in _RE_PAGE_DOS.finditer(combined_text):
+        idx = bisect_right(offsets, m.start() + lead) - 1
+        if idx in seen:
+            continue
+        seen.add(idx)
+        dos = _normalize_date_token(m.group(1).strip())
+        if dos:
+            page_level_dos[idx] = dos
+    return page_level_dos
+
+def _detect_page_level_signals(page_texts, want_dos=True, want_subs=True, combined_text=None, page_offsets=None):
+    """
+    Page-level DOS and subscriber maps ({page_idx: value}) from a single walk over the pages.
+    With combined_text and page_offsets, DOS comes from one scan of the combined text instead.
+    """
+    page_level_dos = {}
     page_level_subs = {}
+    if want_dos and combined_text is not None and page_offsets is not None:
+        page_level_dos = _page_level_dos_from_combined(combined_text, page_texts, page_offsets)
+        want_dos = False
     for idx, ptxt in enumerate(page_texts):
-        if not ptxt:
+        if not ptxt or not (want_dos or want_subs):
             continue
-        for m in re.finditer(r"Subscriber(?: ID)?[:\s]*([A-Za-z0-9\-]{5,20})", ptxt, re.I):
-            cand = m.group(1).strip()
-            if not re.fullmatch(r"\d{1,6}", cand):
-                page_level_subs[idx] = cand
-                break
-        if idx not in page_level_subs:
-            best = None
-            best_score = -10**9
-            tokens = re.findall(r"\b([A-Z0-9\-]{6,20})\b", ptxt, re.I)
-            for t in tokens:
-                sc = _score_subscriber_candidate(t, ptxt)
-                if sc > best_score:
-                    best_score = sc
-                    best = t
-            if best_score > 0:
-                page_level_subs[idx] = best
-    return page_level_subs
-
-def _recover_missing_fields_aggressive(cleaned, combined_text, page_texts, page_level_dos=None, page_level_subs=None):
+        if want_dos:
+            dos = _page_dos(ptxt)
+            if dos:
+                page_level_dos[idx] = dos
+        if want_subs:
+            sub = _page_subscriber(ptxt)
+            if sub is not None:
+                page_level_subs[idx] = sub
+    return page_level_dos, page_level_subs
+
+def _insurance_value(m):
+    # the label pattern can capture bare whitespace ("Insurance:   "), which has no first line
+    lines = m.group(1).strip().splitlines()
+    return _RE_MULTI_SPACE.sub(" ", lines[0].strip()) if lines else ""
+
+def _index_window_fields(text):
+    """
+    Scan text once per recovery field. Each kind keeps its hits as sorted start/end
+    offset arrays (finditer hits never overlap) plus the parsed values, so a window
+    query is two bisects and a slice instead of a regex pass over the window.
+    """
+    def _hits(regex, value, word_start=False):
+        starts, ends, values = array("i"), array("i"), []
+        for m in regex.finditer(text):
+            starts.append(m.start())
+            ends.append(m.end())
+            values.append(value(m))
+        return text, regex, value, word_start, starts, ends, values
+
+    return {
+        "dob": _hits(_RE_DOB_LABEL, lambda m: m.group(1).strip(), word_start=True),
+        "dos": _hits(_RE_DOS_LABEL, lambda m: m.group(1).strip()),
+        "date": _hits(_RE_DATE_TOKEN, lambda m: m.group(1)),
+        "sub": _hits(_RE_SUB_LABEL, lambda m: m.group(1).strip()),
+        "ins": _hits(_RE_INS_LABEL, _insurance_value),
+    }
+
+class _PageFieldCache(dict):
+    """page_idx -> _index_window_fields(page), built the first time a page is asked for."""
+    __slots__ = ("page_texts",)
+
+    def __init__(self, page_texts):
+        super().__init__()
+        self.page_texts = page_texts
+
+    def __missing__(self, page_idx):
+        fields = self[page_idx] = _index_window_fields(self.page_texts[page_idx])
+        return fields
+
+def _build_page_candidate_cache(page_texts):
+    # shared by every patient in one recovery pass, so each page is regex-scanned at most once
+    return _PageFieldCache(page_texts)
+
+def _window_edge_match(hits, start, end):
+    # a pattern opening with \b can match at a window that starts mid-word even though
+    # the page-wide scan saw no boundary there
+    text, regex, value, word_start = hits[:4]
+    if not word_start or not start or not (text[start - 1].isalnum() or text[start - 1] == "_"):
+        return None
+    return regex.match(text[start:end])
+
+def _first_field_in(hits, start, end):
+    # what regex.search(text[start:end]) would return, read off the page-wide hits
+    text, regex, value, word_start, starts, ends, values = hits
+    i = bisect_left(starts, start)
+    if i and ends[i - 1] > start:
+        # a hit straddles the window start and may hide a shorter match; rescan the window
+        m = regex.search(text[start:end])
+        return value(m) if m else None
+    m = _window_edge_match(hits, start, end)
+    if m:
+        return value(m)
+    if i == len(starts) or starts[i] >= end:
+        return None
+    if ends[i] <= end:
+        return values[i]
+    # runs past the window end: search again within the clipped text
+    m = regex.search(text, starts[i], end)
+    return value(m) if m else None
+
+def _fields_in(hits, start, end):
+    # what regex.finditer(text[start:end]) would yield, read off the page-wide hits
+    text, regex, value, word_start, starts, ends, values = hits
+    i = bisect_left(starts, start)
+    if (i and ends[i - 1] > start) or _window_edge_match(hits, start, end):
+        return [value(m) for m in regex.finditer(text[start:end])]
+    k = bisect_right(ends, end)
+    found = values[i:k]
+    if k < len(starts) and starts[k] < end:
+        found.extend(value(m) for m in regex.finditer(text, starts[k], end))
+    return found
+
+def _missing_fields(p):
+    return {
+        "Date of Birth": (not p.get("Date of Birth") or p.get("Date of Birth") in _MISSING),
+        "Date of Service": (not p.get("Date of Service") or p.get("Date of Service") in _MISSING),
+        "Subscriber ID": (not p.get("Subscriber ID") or p.get("Subscriber ID") in _MISSING),
+        "Primary Insurance": (not p.get("Primary Insurance") or p.get("Primary Insurance") in _MISSING),
+    }
+
+def _default_insurance(cleaned):
+    for p in cleaned:
+        if not p.get("Primary Insurance") or p.get("Primary Insurance") in _MISSING:
+            p["Primary Insurance"] = p.get("Primary Insurance", "NIL") or "NIL"
+
+def _recover_missing_fields_aggressive(cleaned, combined_text, page_texts, page_level_dos=None, page_level_subs=None, occurrences=None, page_offsets=None):
     """
     Fill missing DOB/DOS/Subscriber/Insurance by searching windows near the patient's base name.
     Conservative: avoids setting DOS equal to DOB; prefers labeled fields.
+    Page-level DOS/subscriber maps left as None are detected here, and only when some
+    patient is actually missing that field.
     """
+    pending = []
+    for p in cleaned:
+        base = _patient_base(p)
+        if not base:
+            continue
+        need = _missing_fields(p)
+        if any(need.values()):
+            pending.append((p, base, need))
+    if not pending:
+        _default_insurance(cleaned)
+        return cleaned
+
+    if page_offsets is None:
+        page_offsets = _page_offsets(page_texts)
+
+    want_dos = page_level_dos is None and any(need["Date of Service"] for _, _, need in pending)
+    want_subs = page_level_subs is None and any(need["Subscriber ID"] for _, _, need in pending)
+    if want_dos or want_subs:
+        detected_dos, detected_subs = _detect_page_level_signals(page_texts, want_dos, want_subs, combined_text, page_offsets)
+    else:
+        detected_dos, detected_subs = {}, {}
     if page_level_dos is None:
-        page_level_dos = {}
+        page_level_dos = detected_dos
     if page_level_subs is None:
-        page_level_subs = _detect_page_level_subscribers(page_texts)
+        page_level_subs = detected_subs
+    if occurrences is None:
+        occurrences = _index_base_occurrences(page_texts, (_patient_base(p) for p in cleaned))
 
-    page_offsets = []
-    offset = 0
-    for ptxt in page_texts:
-        page_offsets.append(offset)
-        offset += len(ptxt) + len(SEPARATOR)
-    page_offsets.append(offset)
+    page_fields = _build_page_candidate_cache(page_texts)
+    combined_fields = None
+    combined_positions = None
 
-    def _extract_from_window(window):
+    def _extract_at(fields, text, start, end):
         found = {}
-        mdob_label = re.search(r"\bDOB[:\s]*([0-9]{1,2}/[0-9]{1,2}/(?:[0-9]{4}|\d{2}))", window, re.I)
-        if mdob_label:
-            found["Date of Birth"] = _normalize_date_token(mdob_label.group(1).strip())
-        mdos_label = re.search(r"(?:Date\s+of\s+Service|Visit\s+Date|Order\s+Date|DOS)[:\s]*([0-9]{1,2}/[0-9]{1,2}/(?:[0-9]{4}|\d{2}))", window, re.I)
-        if mdos_label:
-            found["Date of Service"] = _normalize_date_token(mdos_label.group(1).strip())
-        date_tokens = re.findall(r"([0-9]{1,2}/[0-9]{1,2}/(?:[0-9]{4}|\d{2}))", window)
+        dob_label = _first_field_in(fields["dob"], start, end)
+        if dob_label is not None:
+            found["Date of Birth"] = _normalize_date_token(dob_label)
+        dos_label = _first_field_in(fields["dos"], start, end)
+        if dos_label is not None:
+            found["Date of Service"] = _normalize_date_token(dos_label)
+        date_tokens = _fields_in(fields["date"], start, end)
         normalized_dates = [_normalize_date_token(d) for d in date_tokens]
-        four_digit = [d for d in normalized_dates if d and re.match(r".*/.*/\d{4}$", d)]
-        two_digit = [d for d in normalized_dates if d and re.match(r".*/.*/\d{2}$", d)]
+        four_digit = [d for d in normalized_dates if d and _RE_YEAR4_SUFFIX.match(d)]
+        two_digit = [d for d in normalized_dates if d and _RE_YEAR2_SUFFIX.match(d)]
         if "Date of Birth" not in found:
             if four_digit:
                 found["Date of Birth"] = four_digit[0]
@@ -514,83 +1034,70 @@ def _recover_missing_fields_aggressive(cleaned, combined_text, page_texts, page_
                     break
             if candidate:
                 found["Date of Service"] = candidate
-        msub = re.search(r"Subscriber(?: ID)?[:\s]*([A-Za-z0-9\-]{5,20})", window, re.I)
-        if msub:
-            cand = msub.group(1).strip()
-            if not re.fullmatch(r"\d{1,6}", cand):
+        cand = _first_field_in(fields["sub"], start, end)
+        if cand is not None:
+            if not _RE_SHORT_NUMBER.fullmatch(cand):
                 found["Subscriber ID"] = cand
         else:
-            cand = _best_subscriber_from_window(window)
+            cand = _best_subscriber_from_window(text[start:end])
             if cand:
                 found["Subscriber ID"] = cand
-        mins = re.search(r"(?:Primary\s+Insurance|Primary\s+Payor|Payor|Insurance)[:\s]*([^\n\r]{3,80})", window, re.I)
-        if mins:
-            val = mins.group(1).strip().splitlines()[0].strip()
-            val = re.sub(r"\s{2,}", " ", val)
-            found["Primary Insurance"] = val
+        ins = _first_field_in(fields["ins"], start, end)
+        if ins:
+            found["Primary Insurance"] = ins
         return found
 
-    for p in cleaned:
-        base = p.get("Base Name") or _base_name(p.get("Patient Name") or "")
-        if not base:
-            continue
-        need = {
-            "Date of Birth": (not p.get("Date of Birth") or p.get("Date of Birth") in ("", "NIL")),
-            "Date of Service": (not p.get("Date of Service") or p.get("Date of Service") in ("", "NIL")),
-            "Subscriber ID": (not p.get("Subscriber ID") or p.get("Subscriber ID") in ("", "NIL", "")),
-            "Primary Insurance": (not p.get("Primary Insurance") or p.get("Primary Insurance") in ("", "NIL")),
-        }
-        if not any(need.values()):
-            continue
+    for p, base, need in pending:
+        hits = occurrences.get(base, ())
         # page-level
-        for page_index, page_text in enumerate(page_texts):
-            if re.search(re.escape(base), page_text, re.I):
-                page_sub = page_level_subs.get(page_index)
-                if page_sub and need["Subscriber ID"]:
-                    p["Subscriber ID"] = page_sub
-                    need["Subscriber ID"] = False
-                page_dos = page_level_dos.get(page_index)
-                if page_dos and need["Date of Service"]:
-                    if p.get("Date of Birth") not in (None, "", "NIL") and _normalize_date_token(p.get("Date of Birth")) == _normalize_date_token(page_dos):
-                        pass
-                    else:
-                        p["Date of Service"] = page_dos
-                        need["Date of Service"] = False
-                if not any(need.values()):
-                    break
+        for page_index in dict.fromkeys(hit[0] for hit in hits):
+            page_sub = page_level_subs.get(page_index)
+            if page_sub and need["Subscriber ID"]:
+                p["Subscriber ID"] = page_sub
+                need["Subscriber ID"] = False
+            page_dos = page_level_dos.get(page_index)
+            if page_dos and need["Date of Service"]:
+                if p.get("Date of Birth") not in (None, "", "NIL") and _normalize_date_token(p.get("Date of Birth")) == _normalize_date_token(page_dos):
+                    pass
+                else:
+                    p["Date of Service"] = page_dos
+                    need["Date of Service"] = False
+            if not any(need.values()):
+                break
         if not any(need.values()):
             continue
         # windowed search around each occurrence of base on each page
-        for page_index, page_text in enumerate(page_texts):
-            for m in re.finditer(re.escape(base), page_text, re.I):
-                start = max(0, m.start() - 600)
-                end = min(len(page_text), m.end() + 600)
-                window = page_text[start:end]
-                found = _extract_from_window(window)
-                if "Date of Birth" in found and need["Date of Birth"]:
-                    p["Date of Birth"] = found["Date of Birth"]
-                    need["Date of Birth"] = False
-                if "Date of Service" in found and need["Date of Service"]:
-                    if found["Date of Service"] != p.get("Date of Birth"):
-                        p["Date of Service"] = found["Date of Service"]
-                        need["Date of Service"] = False
-                if "Subscriber ID" in found and need["Subscriber ID"]:
-                    p["Subscriber ID"] = found["Subscriber ID"]
-                    need["Subscriber ID"] = False
-                if "Primary Insurance" in found and need["Primary Insurance"]:
-                    p["Primary Insurance"] = found["Primary Insurance"]
-                    need["Primary Insurance"] = False
-                if not any(need.values()):
-                    break
+        for page_index, m_start, m_end in hits:
+            page_text = page_texts[page_index]
+            start = max(0, m_start - 600)
+            end = min(len(page_text), m_end + 600)
+            fields = page_fields[page_index]
+            found = _extract_at(fields, page_text, start, end)
+            if "Date of Birth" in found and need["Date of Birth"]:
+                p["Date of Birth"] = found["Date of Birth"]
+                need["Date of Birth"] = False
+            if "Date of Service" in found and need["Date of Service"]:
+                if found["Date of Service"] != p.get("Date of Birth"):
+                    p["Date of Service"] = found["Date of Service"]
+                    need["Date of Service"] = False
+            if "Subscriber ID" in found and need["Subscriber ID"]:
+                p["Subscriber ID"] = found["Subscriber ID"]
+                need["Subscriber ID"] = False
+            if "Primary Insurance" in found and need["Primary Insurance"]:
+                p["Primary Insurance"] = found["Primary Insurance"]
+                need["Primary Insurance"] = False
             if not any(need.values()):
                 break
         # fallback combined_text
         if any(need.values()):
-            for m in re.finditer(re.escape(base), combined_text, re.I):
-                start = max(0, m.start() - 1000)
-                end = min(len(combined_text), m.end() + 1000)
-                window = combined_text[start:end]
-                found = _extract_from_window(window)
+            if combined_positions is None:
+                combined_positions = _combined_base_positions(page_texts, page_offsets, occurrences)
+            for pos in combined_positions.get(base, ()):
+                start = max(0, pos - 1000)
+                end = min(len(combined_text), pos + len(base) + 1000)
+                if combined_fields is None:
+                    combined_fields = _index_window_fields(combined_text)
+                found = _extract_at(combined_fields, combined_text, start, end)
                 if "Date of Birth" in found and need["Date of Birth"]:
                     p["Date of Birth"] = found["Date of Birth"]
                     need["Date of Birth"] = False
@@ -606,72 +1113,137 @@ def _recover_missing_fields_aggressive(cleaned, combined_text, page_texts, page_
                     need["Primary Insurance"] = False
                 if not any(need.values()):
                     break
-    for p in cleaned:
-        if not p.get("Primary Insurance") or p.get("Primary Insurance") in ("", "NIL"):
-            p["Primary Insurance"] = p.get("Primary Insurance", "NIL") or "NIL"
+    _default_insurance(cleaned)
     return cleaned
 
 # -----------------------
 # Main extractor
 # -----------------------
-def extract_fields_from_pdf(file_obj, vision_enabled=True):
-    vision_client = None
-    if vision_enabled and _HAS_VISION:
+@lru_cache(maxsize=1)
+def _get_vision_client():
+    # fallback for standalone use only; app.py passes its own tuned client (keepalive channel)
+    # one authenticated client per process; a failed init is not cached and is retried next call
+    return vision.ImageAnnotatorClient()
+
+def _extract_page_text(local, page_index, vision_client, vision_timeout=VISION_TIMEOUT):
+    try:
+        page = local.doc.load_page(page_index)
+        native = page.get_text("text") or ""
+        if not vision_client or len(native.strip()) >= VISION_MIN_NATIVE_CHARS:
+            return native
+        # little or no text layer: likely a scan, so OCR it
+        try:
+            pix = page.get_pixmap(dpi=VISION_DPI, alpha=False)
+            img_bytes = pix.tobytes("jpg", jpg_quality=VISION_JPEG_QUALITY)
+            resp = vision_client.document_text_detection(image=vision.Image(content=img_bytes), timeout=vision_timeout)
+            if getattr(resp, "full_text_annotation", None) and resp.full_text_annotation.text:
+                return resp.full_text_annotation.text
+        except Exception:
+            pass
+        return native
+    except Exception as e:
+        logger.warning("Page text extraction error: %s", e)
+        return ""
+
+def extract_fields_from_pdf(file_obj, vision_enabled=True, vision_client=None, vision_timeout=VISION_TIMEOUT):
+    """
+    vision_client: an ImageAnnotatorClient owned by the caller (app.py keeps one per process);
+    when omitted, a default client is created here. vision_enabled=False skips Vision entirely.
+    """
+    if not vision_enabled:
+        vision_client = None
+    elif vision_client is None and _HAS_VISION:
         try:
-            vision_client = vision.ImageAnnotatorClient()
+            vision_client = _get_vision_client()
         except Exception as e:
             logger.info("Vision client init failed: %s (falling back to PyMuPDF)", e)
             vision_client = None
 
+    # a real file on disk is opened by path so MuPDF maps it instead of us holding a full copy
+    name = getattr(file_obj, "name", None)
+    pdf_path = name if isinstance(name, str) and os.path.isfile(name) else None
+    pdf_bytes = None
+    if pdf_path is None:
+        try:
+            file_obj.seek(0)
+        except Exception:
+            pass
+        pdf_bytes = file_obj.read()
+
+    def open_pdf():
+        if pdf_path is not None:
+            return fitz.open(pdf_path, filetype="pdf")
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+
     try:
-        file_obj.seek(0)
-    except Exception:
-        pass
-    pdf_bytes = file_obj.read()
-    try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        doc = open_pdf()
     except Exception as e:
         logger.error("Failed to open PDF: %s", e)
         return {"patients": [], "procedure_tables": {}, "patient_procedures": {}, "file_name": getattr(file_obj, "name", None)}
 
-    page_texts = []
-    for page in doc:
-        try:
-            txt = ""
-            if vision_client:
-                try:
-                    pix = page.get_pixmap(dpi=300)
-                    img_bytes = pix.tobytes("png")
-                    resp = vision_client.document_text_detection(image=vision.Image(content=img_bytes))
-                    if getattr(resp, "full_text_annotation", None) and resp.full_text_annotation.text:
-                        txt = resp.full_text_annotation.text
-                except Exception:
-                    txt = page.get_text("text") or ""
-            else:
-                txt = page.get_text("text") or ""
-            page_texts.append(txt or "")
-        except Exception as e:
-            logger.warning("Page text extraction error: %s", e)
-            page_texts.append("")
+    # the main document is only needed through segmentation (block layout); close it after
+    try:
+        # PyMuPDF documents are not thread-safe, so each worker opens its own copy
+        page_count = doc.page_count
+        local = threading.local()
 
-    combined_text = SEPARATOR.join(page_texts).strip()
-    if not combined_text or all(len(p.strip()) == 0 for p in page_texts):
-        logger.info("No text extracted.")
-        return {"patients": [], "procedure_tables": {}, "patient_procedures": {}, "file_name": getattr(file_obj, "name", None)}
+        worker_docs = []
+        worker_docs_lock = threading.Lock()
+
+        def open_worker_doc():
+            local.doc = open_pdf()
+            with worker_docs_lock:
+                worker_docs.append(local.doc)
+
+        workers = max(1, min(PAGE_WORKERS, page_count))
+        if workers == 1:
+            local.doc = doc
+            page_texts = [_extract_page_text(local, i, vision_client, vision_timeout) for i in range(page_count)]
+        else:
+            try:
+                with ThreadPoolExecutor(max_workers=workers, initializer=open_worker_doc) as ex:
+                    page_texts = list(ex.map(lambda i: _extract_page_text(local, i, vision_client, vision_timeout), range(page_count)))
+            finally:
+                for d in worker_docs:
+                    d.close()
+
+        combined_text = SEPARATOR.join(page_texts).strip()
+        if not combined_text or all(len(p.strip()) == 0 for p in page_texts):
+            logger.info("No text extracted.")
+            return {"patients": [], "procedure_tables": {}, "patient_procedures": {}, "file_name": getattr(file_obj, "name", None)}
+
+        # build candidate patient segments
+        page_offsets = _page_offsets(page_texts)
+
+        def load_blocks():
+            # MuPDF already knows the paragraph layout of text-layer pages; only usable when
+            # the blocks carry the same text we extracted (not the case for Vision-OCR'd scans)
+            try:
+                page_blocks = [doc.load_page(i).get_text("blocks") for i in range(page_count)]
+            except Exception as e:
+                logger.info("Block extraction failed: %s", e)
+                return None
+            for ptxt, blocks in zip(page_texts, page_blocks):
+                block_text = "".join(b[4] for b in blocks if b[6] == 0)
+                if "".join(ptxt.split()) != "".join(block_text.split()):
+                    return None
+            return page_blocks, page_texts, page_offsets
+
+        segments = _split_segments(combined_text, load_blocks)
+    finally:
+        doc.close()
 
-    # build candidate patient segments
-    segments = _split_segments(combined_text)
     candidates = []
     for seg in segments:
         text = seg["text"]
-        patient_name = _first_match(r"(?i)Patient(?:\s+Full|\s+Name)?[:\s]*([A-Za-z0-9 ,.'\-]+|NIL)\b", text)
+        patient_name = _first_match(_RE_PATIENT_NAME_VALUE, text)
         if not patient_name:
-            patient_name = _first_match(r"\b([A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,}(?:[A-Z ,.'\-\(\)]*)?)\b", text)
+            patient_name = _first_match(_RE_LASTFIRST_FULL, text)
         if not patient_name or patient_name.strip().upper() == "NIL":
             lines = [ln.rstrip() for ln in text.splitlines()]
             found = False
             for i, ln in enumerate(lines):
-                m = re.match(r"(?i)^\s*Patient(?:\s+Full|\s+Name)?\s*[:\-\s]\s*(.*)$", ln)
+                m = _RE_PATIENT_LINE.match(ln)
                 if m:
                     tail = m.group(1).strip()
                     if tail and tail.upper() != "NIL":
@@ -691,26 +1263,26 @@ def extract_fields_from_pdf(file_obj, vision_enabled=True):
                         break
             if not found and (not patient_name or patient_name.strip().upper() == "NIL"):
                 for ln in lines:
-                    if re.match(r"^[A-Z][A-Z'`.\-]{1,}[,]\s+[A-Z][A-Z'`.\-]{1,}(?:[A-Z ,.'\-\(\)]*)?$", ln.strip()):
+                    if _RE_LASTFIRST_LINE.match(ln.strip()):
                         candidate = ln.strip()
                         if candidate.upper() != "NIL":
                             patient_name = candidate
                             break
 
         patient_name = _normalize_name(patient_name) if patient_name else "NIL"
-        dob = _first_match(r"\bDOB[:\s]*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})", text, re.I)
+        dob = _first_match(_RE_DOB_VALUE, text)
         if not dob and patient_name and patient_name != "NIL":
             pos = text.find(patient_name)
             if pos >= 0:
                 window = text[pos: pos + 300]
-                m3 = re.search(r"([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})", window)
+                m3 = _RE_DATE_VALUE.search(window)
                 if m3:
                     dob = m3.group(1).strip()
-        subscriber = _first_match(r"Subscriber(?: ID)?[:\s]*([A-Za-z0-9\-]{5,20})", text, re.I) or ""
-        if subscriber and re.fullmatch(r"\d{1,6}", subscriber):
+        subscriber = _first_match(_RE_SUB_LABEL, text) or ""
+        if subscriber and _RE_SHORT_NUMBER.fullmatch(subscriber):
             subscriber = ""
-        insurance = _first_match(r"(?:Primary\s+Insurance|Primary\s+Payor|Payor|Insurance)[:\s]*([^\n\r]+)", text, re.I)
-        dos = _first_match(r"(?:Date\s+of\s+Service|Order\s+Date|Visit\s+Date|DOS)[:\s]*([0-9]{1,2}/[0-9]{1,2}/[0-9]{2,4})", text, re.I)
+        insurance = _first_match(_RE_INS_VALUE, text)
+        dos = _first_match(_RE_DOS_VALUE, text)
 
         candidates.append({
             "Patient Name": patient_name if patient_name else "NIL",
@@ -721,69 +1293,36 @@ def extract_fields_from_pdf(file_obj, vision_enabled=True):
         })
 
     cleaned = _merge_patients(candidates, combined_text)
+    occurrences = _index_base_occurrences(page_texts, (_patient_base(p) for p in cleaned))
 
-    # page-level DOS and subscribers
-    page_level_dos = {}
-    dos_label_re = re.compile(r"(?:Date\s+of\s+Service|Visit\s+Date|Order\s+Date|DOS)[:\s]*([0-9]{1,2}/[0-9]{1,2}/(?:\d{4}|\d{2}))", re.I)
-    for idx, ptxt in enumerate(page_texts):
-        if not ptxt:
-            continue
-        m = dos_label_re.search(ptxt)
-        if m:
-            dos_raw = m.group(1).strip()
-            dos_norm = _normalize_date_token(dos_raw)
-            if dos_norm:
-                page_level_dos[idx] = dos_norm
-
-    page_level_subs = _detect_page_level_subscribers(page_texts)
-
-    # recover missing fields
-    cleaned = _recover_missing_fields_aggressive(cleaned, combined_text, page_texts, page_level_dos, page_level_subs)
+    # recover missing fields (page-level DOS/subscriber scans only run if something is missing)
+    cleaned = _recover_missing_fields_aggressive(cleaned, combined_text, page_texts, None, None, occurrences, page_offsets)
 
     # Extract E&M blocks per page
-    em_by_page = {}
-    for page_idx, ptxt in enumerate(page_texts):
-        blocks = extract_em_sections_from_page_text(ptxt)
-        if blocks:
-            em_by_page[page_idx] = blocks
+    em_by_page = _extract_em_by_page(page_texts)
 
     # assign E&M rows to patients
-    patient_em_map = assign_em_rows_to_patients(em_by_page, page_texts, cleaned, combined_text)
+    patient_em_map = assign_em_rows_to_patients(em_by_page, page_texts, cleaned, combined_text, occurrences, page_offsets)
 
-    # prepare final patients list and attach only E&M rows
-    final_patients = []
-    for p in cleaned:
-        base = _base_name(p.get("Patient Name") or "")
-        patient_name = base if base else _normalize_name(p.get("Patient Name") or "NIL")
-        dob = p.get("Date of Birth") or "NIL"
-        if dob and dob != "NIL":
-            dob = _normalize_date_token(dob) or dob
-        dos = p.get("Date of Service") or "NIL"
-        if dos and dos != "NIL":
-            dos = _normalize_date_token(dos) or dos
-        insurance = p.get("Primary Insurance") or "NIL"
-        subscriber = p.get("Subscriber ID") or "NIL"
-
-        em_rows = patient_em_map.get(base, []) or []
-
-        final_patients.append({
-            "Base Name": base if base else "NIL",
-            "Patient Name": patient_name if patient_name else "NIL",
-            "Date of Birth": dob if dob else "NIL",
-            "Date of Service": dos if dos else "NIL",
-            "Primary Insurance": insurance if insurance else "NIL",
-            "Subscriber ID": subscriber if subscriber else "NIL",
-            "EvaluationAndManagement_Procedures": em_rows,
-        })
+    # prepare final patients list (built field by field, then zipped) and attach only E&M rows
+    raw_names = [p.get("Patient Name") or "" for p in cleaned]
+    bases = list(map(_base_name, raw_names))
+    patient_em = [patient_em_map.get(base, []) or [] for base in bases]
+    names = [base or _normalize_name(raw or _NIL) or _NIL for base, raw in zip(bases, raw_names)]
+    bases = [base or _NIL for base in bases]
+    dobs = list(map(_final_date, [p.get("Date of Birth") for p in cleaned]))
+    doses = list(map(sys.intern, map(_final_date, [p.get("Date of Service") for p in cleaned])))
+    insurances = [sys.intern(p.get("Primary Insurance") or _NIL) for p in cleaned]
+    subscribers = [p.get("Subscriber ID") or _NIL for p in cleaned]
 
     cleaned_proc_tables = {}
     for page_idx, blocks in em_by_page.items():
         for b in blocks:
             hdr = b.get("header", "EVALUATION AND MANAGEMENT")
-            cleaned_proc_tables.setdefault(hdr, []).extend([[r[0], r[1], r[2]] for r in b.get("parsed_rows", [])])
+            cleaned_proc_tables.setdefault(hdr, []).extend(map(_EM_ROW_FIELDS, b.get("parsed_rows", ())))
 
     return {
-        "patients": final_patients,
+        "patients": [dict(zip(_PATIENT_KEYS, row)) for row in zip(bases, names, dobs, doses, insurances, subscribers, patient_em)],
         "procedure_tables": cleaned_proc_tables,
         "patient_procedures": patient_em_map,
         "file_name": getattr(file_obj, "name", None) or "unknown.pdf"
@@ -797,27 +1336,28 @@ def display_patient_em_only(result, print_fn=print):
     if not patients:
         print_fn("No patients found.")
         return
-    print_fn(f"{len(patients)} patient(s) found.")
+    # collect every line and hand print_fn one string, instead of one write per line
+    buf = [f"{len(patients)} patient(s) found."]
     for i, p in enumerate(patients, start=1):
-        print_fn("=" * 60)
-        print_fn(f"Patient {i}: {p.get('Patient Name','NIL')}")
-        print_fn("-" * 60)
-        print_fn(f"Base Name: {p.get('Base Name','NIL')}")
-        print_fn(f"Date of Birth: {p.get('Date of Birth','NIL')}")
-        print_fn(f"Date of Service: {p.get('Date of Service','NIL')}")
-        print_fn(f"Primary Insurance: {p.get('Primary Insurance','NIL')}")
-        print_fn(f"Subscriber ID: {p.get('Subscriber ID','NIL')}")
-        print_fn("\nEVALUATION AND MANAGEMENT (NEW PATIENT) Procedures:")
+        buf.append("=" * 60)
+        buf.append(f"Patient {i}: {p.get('Patient Name','NIL')}")
+        buf.append("-" * 60)
+        buf.append(f"Base Name: {p.get('Base Name','NIL')}")
+        buf.append(f"Date of Birth: {p.get('Date of Birth','NIL')}")
+        buf.append(f"Date of Service: {p.get('Date of Service','NIL')}")
+        buf.append(f"Primary Insurance: {p.get('Primary Insurance','NIL')}")
+        buf.append(f"Subscriber ID: {p.get('Subscriber ID','NIL')}")
+        buf.append("\nEVALUATION AND MANAGEMENT (NEW PATIENT) Procedures:")
         em = p.get("EvaluationAndManagement_Procedures", [])
         if not em:
-            print_fn("  No E&M (New Patient) procedures found for this patient.")
+            buf.append("  No E&M (New Patient) procedures found for this patient.")
         else:
             for r in em:
-                print_fn(f"  - Code: {r.get('Code','')} \t Desc: {r.get('Description','')} \t Fee: {r.get('Fee','')}")
-        print_fn("\n")
+                buf.append(f"  - Code: {r.get('Code','')} \t Desc: {r.get('Description','')} \t Fee: {r.get('Fee','')}")
+        buf.append("\n")
+    print_fn("\n".join(buf))
 
 if __name__ == "__main__":
-    import sys
     pdf_path = sys.argv[1] if len(sys.argv) > 1 else "/mnt/data/Sample pdf ocr 1.pdf"
     with open(pdf_path, "rb") as fh:
         res = extract_fields_from_pdf(fh, vision_enabled=False)
@@ -0,0 +1,73 @@
+# test_extract_patterns.py
+"""
+The whole-page scans in extract_fields_from_pdf go through RE2 when it is installed.
+They must find exactly what plain re finds, including on non-ASCII page text.
+
+Run from backend/:  python -m pytest -q test_extract_patterns.py
+"""
+
+import re
+import sys
+import importlib.util
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("re2")
+
+MODULE_PATH = Path(__file__).with_name("extract_fields_from_pdf.py")
+
+
+def _load(name, with_re2):
+    spec = importlib.util.spec_from_file_location(name, MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # a None entry in sys.modules makes "import re2" raise ImportError
+    with mock.patch.dict(sys.modules, {} if with_re2 else {"re2": None}):
+        spec.loader.exec_module(module)
+    return module
+
+
+FAST = _load("_extract_with_re2", with_re2=True)
+PLAIN = _load("_extract_with_re", with_re2=False)
+
+# every _RE_* scan that actually compiled with RE2
+SCANS = sorted(
+    name for name, obj in vars(FAST).items()
+    if name.startswith("_RE") and hasattr(obj, "finditer") and not isinstance(obj, re.Pattern)
+)
+
+SAMPLES = [
+    "Patient Name: DOE, JANE\nDOB:\xa001/02/1980\nDate of Service:\xa003/04/2024",
+    "Subscriber ID:\xa0ABC12345\nPrimary Insurance: Blue Cross PPO",
+    "Visit Date　 05/06/24\nDOS 06/07/2024",
+    "Insurance\xa0\xa0Aetna Subscriber XYZ-98765",
+    "Date of Service: ٠١/٠٢/٢٠٢٤ and 1/2/２４",
+    "SUBSCRİBER ID: ıABC123\nPRIMARY İNSURANCE: Café Santé",
+    "EVALUATION\xa0AND MANAGEMENT (NEW PATIENT)\nCode\xa0Description Fee\n99203 Office visit 150.00",
+    "Order\x85Date:\x0b07/08/2023\x1cPayor:\x1fMedicare Part B",
+]
+
+
+def _hits(pattern, text):
+    return [(m.span(), m.groups()) for m in pattern.finditer(text)]
+
+
+def test_scans_use_re2():
+    assert SCANS, "RE2 is installed but no scan pattern compiled with it"
+
+
+@pytest.mark.parametrize("name", SCANS)
+@pytest.mark.parametrize("text", SAMPLES)
+def test_re2_matches_re_on_non_ascii(name, text):
+    fast, plain = getattr(FAST, name), getattr(PLAIN, name)
+    if isinstance(plain.pattern, bytes):
+        pytest.skip("bytes scans only run on ASCII pages")
+    assert _hits(fast, text) == _hits(plain, text)
+
+
+def test_nbsp_after_label_is_found():
+    text = "Date of Service:\xa003/04/2024\nSubscriber ID:\xa0ABC12345\nPrimary Insurance:\xa0Aetna"
+    assert FAST._RE_DOS_LABEL.search(text).group(1) == "03/04/2024"
+    assert FAST._RE_SUB_LABEL.search(text).group(1) == "ABC12345"
+    assert FAST._RE_INS_LABEL.search(text).group(1) == "Aetna"